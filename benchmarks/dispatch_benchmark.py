@@ -0,0 +1,384 @@
+"""
+Offline dispatch benchmark for Weeping Willow.
+
+Builds a WeepingWillowClient with every module that is on by default registered, backed by stub Discord objects
+and an in-memory data connection, then pushes synthetic message streams through `on_message` and reports how fast
+they are handled and how much memory handling them takes. Nothing here talks to Discord or Postgres.
+
+Run it from the repository root:
+
+    python -m benchmarks.dispatch_benchmark --messages 20000
+"""
+import argparse
+import asyncio
+import gc
+import logging
+import os
+import sys
+import tracemalloc
+from datetime import datetime, date, time
+from itertools import count
+from time import perf_counter
+from typing import Dict, List
+
+import discord
+
+GUILD_ID = 1000
+TECH_ROLE_ID = 1001
+ADMIN_ROLE_ID = 1002
+PARTICIPANT_ROLE_ID = 1003
+SUPPORT_ROLE_ID = 1004
+VENTING_CHANNEL_ID = 2000
+EVENT_CHANNEL_ID = 2001
+CHAT_CHANNEL_IDS = list(range(3000, 3020))
+
+os.environ.setdefault('BOT_GUILD_ID', str(GUILD_ID))
+os.environ.setdefault('BOT_TECH_ROLE', str(TECH_ROLE_ID))
+os.environ.setdefault('BOT_ADMIN_ROLE', str(ADMIN_ROLE_ID))
+
+from houseofmisfits.weeping_willow import WeepingWillowClient  # noqa: E402
+from houseofmisfits.weeping_willow.config_schema import parse_config, to_raw_config, default_config  # noqa: E402
+from houseofmisfits.weeping_willow.config_bus import ConfigChangeBus  # noqa: E402
+from houseofmisfits.weeping_willow.stats import DatabaseStats  # noqa: E402
+
+message_ids = count()
+
+
+class StubRole:
+    def __init__(self, role_id, name):
+        self.id = role_id
+        self.name = name
+        self.members = []
+
+
+class StubMember:
+    def __init__(self, member_id, roles=(), bot=False):
+        self.id = member_id
+        self.name = 'member{}'.format(member_id)
+        self.nick = None
+        self.discriminator = '0001'
+        self.display_name = self.name
+        self.bot = bot
+        self.roles = list(roles)
+        self.voice = None
+        self.dm_channel = None
+
+    async def add_roles(self, *roles):
+        for role in roles:
+            if role not in self.roles:
+                self.roles.append(role)
+                role.members.append(self)
+
+    async def remove_roles(self, *roles):
+        for role in roles:
+            if role in self.roles:
+                self.roles.remove(role)
+                role.members.remove(self)
+
+    async def create_dm(self):
+        self.dm_channel = StubDMChannel(self.id + 1)
+        return self.dm_channel
+
+
+class StubTextChannel:
+    def __init__(self, channel_id, name):
+        self.id = channel_id
+        self.name = name
+        self.overwrites = {}
+
+    async def send(self, *args, **kwargs):
+        return StubMessage(self, None, '')
+
+    async def history(self, **kwargs):
+        return
+        # noinspection PyUnreachableCode
+        yield
+
+
+class StubDMChannel(discord.DMChannel):
+    # noinspection PyMissingConstructor
+    def __init__(self, channel_id):
+        self.id = channel_id
+        self.name = 'dm'
+
+    async def send(self, *args, **kwargs):
+        return StubMessage(self, None, '')
+
+
+class StubMessage:
+    def __init__(self, channel, author, content, created_at=None):
+        self.channel = channel
+        self.author = author
+        self.content = content
+        self.created_at = created_at or datetime.utcnow()
+        # Event participation is checked against snowflake bounds, so ids have to carry the message's time
+        self.id = discord.utils.time_snowflake(self.created_at) + next(message_ids) % (1 << 22)
+        self.jump_url = 'https://discord.com/channels/{}/{}/{}'.format(GUILD_ID, channel.id, self.id)
+
+    async def delete(self):
+        pass
+
+    async def add_reaction(self, emoji):
+        pass
+
+
+class StubGuild:
+    def __init__(self, roles, members):
+        self.id = GUILD_ID
+        self.roles = roles
+        self.members = members
+        self.member_lookup = {member.id: member for member in members}
+        self.role_lookup = {role.id: role for role in roles}
+
+    def get_member(self, member_id):
+        return self.member_lookup.get(member_id)
+
+    def get_role(self, role_id):
+        return self.role_lookup.get(role_id)
+
+
+class InMemoryConnection:
+    """
+    Answers the handful of queries the modules make, backed by plain Python collections
+    """
+    def __init__(self, data):
+        self.data = data
+
+    async def fetchrow(self, query, *args):
+        return None
+
+    async def fetch(self, query, *args):
+        if 'FROM event_channels' in query:
+            return [{'day_of_week': day, 'channel_id': channel_id}
+                    for day, channel_id in self.data.event_channels.items()]
+        if 'FROM event_participants' in query:
+            return [{'member_id': member_id} for day, member_id in self.data.participants if day == args[0]]
+        return []
+
+    async def execute(self, query, *args):
+        if query.startswith('INSERT INTO event_participants'):
+            self.data.participants.update(zip(args[0], args[1]))
+        elif query.startswith('UPDATE event_channels'):
+            self.data.event_channels[args[0]] = args[1]
+
+    def transaction(self):
+        return self
+
+
+class InMemoryPool:
+    def __init__(self, data):
+        self.connection = InMemoryConnection(data)
+
+    def acquire(self):
+        return self
+
+    async def __aenter__(self):
+        return self.connection
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def close(self):
+        pass
+
+
+class InMemoryDataConnection:
+    """
+    Stands in for WeepingWillowDataConnection without a database
+    """
+    def __init__(self, client, config: Dict[str, str]):
+        self.client = client
+        self.config = dict(config)
+        self.config_changes = ConfigChangeBus()
+        self.event_channels = {day: EVENT_CHANNEL_ID for day in range(7)}
+        self.participants = set()
+        self.pool = InMemoryPool(self)
+        self.stats = DatabaseStats()
+        self.is_connected = True
+
+    def acquire(self):
+        return self.pool.acquire()
+
+    def pool_usage(self):
+        return {}
+
+    async def get_config(self, key, default=None):
+        if key not in self.config and default is not None:
+            self.config[key] = to_raw_config(key, default)
+        if self.config.get(key) is None:
+            return default_config(key)
+        return parse_config(key, self.config[key])
+
+    def get_raw_config(self, key):
+        return self.config.get(key)
+
+    async def get_configs(self, keys, defaults=None):
+        defaults = defaults or {}
+        return [await self.get_config(key, defaults.get(key)) for key in keys]
+
+    async def set_config(self, key, value):
+        self.config[key] = to_raw_config(key, value)
+        self.config_changes.publish(key, await self.get_config(key))
+
+    async def set_configs(self, values):
+        for key, value in values.items():
+            await self.set_config(key, value)
+
+    async def on_config_change(self, key, callback):
+        return self.config_changes.subscribe(key, callback)
+
+    async def close(self):
+        pass
+
+
+class BenchmarkClient(WeepingWillowClient):
+    def __init__(self, queue_size):
+        super(BenchmarkClient, self).__init__()
+        self.data_connection = InMemoryDataConnection(self, {
+            'command_prefix': '.',
+            'venting_channel': str(VENTING_CHANNEL_ID),
+            'venting_deletion_seconds': '300',
+            'participant_role': str(PARTICIPANT_ROLE_ID),
+            'support_role_id': str(SUPPORT_ROLE_ID),
+            'dispatch_queue_size': str(queue_size),
+        })
+        self.get_config = self.data_connection.get_config
+        self.set_config = self.data_connection.set_config
+        self.get_configs = self.data_connection.get_configs
+        self.set_configs = self.data_connection.set_configs
+        self.acquire_data_connection = self.data_connection.acquire
+
+        roles = [StubRole(role_id, name) for role_id, name in [
+            (TECH_ROLE_ID, 'tech'), (ADMIN_ROLE_ID, 'admin'), (PARTICIPANT_ROLE_ID, 'participant'),
+            (SUPPORT_ROLE_ID, 'support')
+        ]]
+        self.admin = StubMember(1, roles=[roles[0]])
+        roles[0].members.append(self.admin)
+        self.members = [StubMember(member_id) for member_id in range(100, 400)]
+        self.stub_guild = StubGuild(roles, [self.admin] + self.members)
+        self.channels = {channel_id: StubTextChannel(channel_id, 'chat-{}'.format(channel_id))
+                         for channel_id in CHAT_CHANNEL_IDS}
+        self.channels[VENTING_CHANNEL_ID] = StubTextChannel(VENTING_CHANNEL_ID, 'venting')
+        self.channels[EVENT_CHANNEL_ID] = StubTextChannel(EVENT_CHANNEL_ID, 'event')
+
+    def get_guild(self, guild_id):
+        return self.stub_guild
+
+    def get_channel(self, channel_id):
+        return self.channels.get(channel_id)
+
+    async def fetch_channel(self, channel_id):
+        return self.channels.get(int(channel_id))
+
+    def get_all_channels(self):
+        return iter(self.channels.values())
+
+    def get_user(self, user_id):
+        return self.stub_guild.get_member(user_id)
+
+    async def set_up(self):
+        self.guild = self.stub_guild
+        await self.set_up_modules()
+        await self.set_up_dispatcher()
+        # Let the modules' background start-up tasks settle before measuring
+        await asyncio.sleep(0.1)
+
+
+def build_messages(client: BenchmarkClient, mix: str, total: int) -> List[StubMessage]:
+    members = client.members
+    chat_channels = [client.channels[channel_id] for channel_id in CHAT_CHANNEL_IDS]
+    event_time = datetime.combine(date.today(), time(17, 0))  # Midday in New York
+    dm_channels = [StubDMChannel(5000 + i) for i in range(20)]
+
+    def command(i):
+        content = ['.events', '.getconfig command_prefix', '.private', '.stats', '.nope x y'][i % 5]
+        return StubMessage(chat_channels[i % len(chat_channels)], members[i % len(members)], content)
+
+    def chat(i):
+        return StubMessage(chat_channels[i % len(chat_channels)], members[i % len(members)],
+                           'just chatting about things number {}'.format(i))
+
+    def venting(i):
+        return StubMessage(client.channels[VENTING_CHANNEL_ID], members[i % len(members)], 'venting {}'.format(i))
+
+    def event(i):
+        return StubMessage(client.channels[EVENT_CHANNEL_ID], members[i % len(members)], 'event post {}'.format(i),
+                           created_at=event_time)
+
+    def dm(i):
+        return StubMessage(dm_channels[i % len(dm_channels)], members[i % len(members)], 'hello bot {}'.format(i))
+
+    makers = {'command': [command], 'chat': [chat], 'venting': [venting], 'event': [event], 'dm': [dm],
+              'mixed': [chat] * 14 + [command, venting, venting, event, event, dm]}[mix]
+    return [makers[i % len(makers)](i) for i in range(total)]
+
+
+async def push(client: BenchmarkClient, messages: List[StubMessage]) -> float:
+    dispatcher = client.dispatcher
+    target = dispatcher.processed + dispatcher.dropped + len(messages)
+    start = perf_counter()
+    for message in messages:
+        await client.on_message(message)
+    while dispatcher.processed + dispatcher.dropped < target:
+        await asyncio.sleep(0)
+    return perf_counter() - start
+
+
+async def run_mix(client: BenchmarkClient, mix: str, total: int) -> Dict[str, float]:
+    # Warm up caches and lazily created state
+    await push(client, build_messages(client, mix, min(total, 500)))
+
+    messages = build_messages(client, mix, total)
+    gc.collect()
+    elapsed = await push(client, messages)
+
+    messages = build_messages(client, mix, total)
+    gc.collect()
+    blocks_before = sys.getallocatedblocks()
+    tracemalloc.start()
+    await push(client, messages)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    # The messages are still alive, as they were for blocks_before, so only what the bot held on to is counted
+    gc.collect()
+    blocks_after = sys.getallocatedblocks()
+    del messages
+
+    return {
+        'messages': total,
+        'per_second': total / elapsed,
+        'us_per_message': elapsed / total * 1000000,
+        'peak_bytes_per_message': peak / total,
+        'retained_blocks_per_message': (blocks_after - blocks_before) / total,
+        'dropped': client.dispatcher.dropped
+    }
+
+
+async def main(args):
+    client = BenchmarkClient(queue_size=args.messages)
+    await client.set_up()
+    print('{:<10} {:>9} {:>12} {:>10} {:>16} {:>16}'.format(
+        'mix', 'messages', 'msgs/sec', 'µs/msg', 'peak B/msg', 'retained blk/msg'
+    ))
+    for mix in args.mix:
+        result = await run_mix(client, mix, args.messages)
+        print('{:<10} {:>9} {:>12.0f} {:>10.1f} {:>16.1f} {:>16.2f}'.format(
+            mix, result['messages'], result['per_second'], result['us_per_message'],
+            result['peak_bytes_per_message'], result['retained_blocks_per_message']
+        ))
+    if client.dispatcher.dropped:
+        print('Warning: the dispatcher dropped {} messages'.format(client.dispatcher.dropped))
+    await client.dispatcher.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Weeping Willow offline dispatch benchmark')
+    parser.add_argument('--messages', type=int, default=20000, help='messages per mix')
+    parser.add_argument('--mix', nargs='+', default=['chat', 'command', 'venting', 'event', 'dm', 'mixed'],
+                        choices=['chat', 'command', 'venting', 'event', 'dm', 'mixed'])
+    parser.add_argument('--log', action='store_true', help="leave logging on instead of disabling it")
+    arguments = parser.parse_args()
+    if not arguments.log:
+        logging.disable(logging.CRITICAL)
+    loop = asyncio.get_event_loop()
+    loop.run_until_complete(main(arguments))
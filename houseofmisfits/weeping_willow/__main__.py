@@ -1,9 +1,10 @@
 from houseofmisfits.weeping_willow import WeepingWillowClient
 
 import logging
+import os
 
 if __name__ == '__main__':
     logging.basicConfig()
-    logging.getLogger().setLevel(logging.DEBUG)
+    logging.getLogger().setLevel(os.getenv('LOG_LEVEL', 'DEBUG').upper())
     client = WeepingWillowClient()
     client.run()
@@ -1,6 +1,13 @@
-from typing import List, ClassVar, Union
-from houseofmisfits.weeping_willow.triggers import Trigger
+from typing import Tuple, ClassVar, Union, Dict
+from houseofmisfits.weeping_willow.triggers import Trigger, TriggerRegistry, MessageContext, CommandPrefix
 from houseofmisfits.weeping_willow import WeepingWillowDataConnection, LoggingEngine, upgrades
+from houseofmisfits.weeping_willow.dispatcher import MessageDispatcher
+from houseofmisfits.weeping_willow.stats import DispatchStats
+from houseofmisfits.weeping_willow.log_sink import FileLogSink
+from houseofmisfits.weeping_willow.history_scanner import HistoryScanner
+from houseofmisfits.weeping_willow.scheduler import JobScheduler
+
+from time import perf_counter
 
 import discord
 import os
@@ -21,12 +28,22 @@ class WeepingWillowClient(discord.Client):
         self.data_connection = WeepingWillowDataConnection(self)
         self.get_config = self.data_connection.get_config
         self.set_config = self.data_connection.set_config
+        self.get_configs = self.data_connection.get_configs
+        self.set_configs = self.data_connection.set_configs
+        self.acquire_data_connection = self.data_connection.acquire
         self.logging_engine = LoggingEngine(self)
+        self.log_sink: Union[FileLogSink, None] = None
         self.guild: Union[discord.Guild, None] = None
-        self.modules = []
-        self.triggers: List[Trigger] = []
+        self.trigger_registry = TriggerRegistry()
+        self.command_prefix = CommandPrefix(self)
+        self.dispatcher = MessageDispatcher(self.process_message)
+        self.stats = DispatchStats()
+        self.history_scanner = HistoryScanner(self)
+        self.scheduler = JobScheduler(self)
+        self.is_set_up = False
 
     def run(self, *args, **kwargs):
+        self.set_up_local_logging()
         logger.info("Bot is starting, use {} to invite bot to server".format(
             discord.utils.oauth_url(
                 client_id=os.getenv('BOT_CLIENT_ID'),
@@ -41,74 +58,196 @@ class WeepingWillowClient(discord.Client):
     async def close(self):
         logger.warning("Bot is shutting down")
         await self.change_presence(status=discord.Status.invisible)
+        await self.dispatcher.stop()
+        self.scheduler.stop()
+        await self.close_modules()
+        await self.history_scanner.save()
         await self.data_connection.close()
-        self.logging_engine.close()
+        await self.logging_engine.stop()
+        if self.log_sink is not None:
+            self.log_sink.stop(logging.getLogger())
         await super(WeepingWillowClient, self).close()
 
+    async def close_modules(self):
+        for module in self.trigger_registry.modules:
+            try:
+                await module.close()
+            except Exception:
+                logger.error("Could not close {}".format(type(module).__name__), exc_info=True)
+
+    def set_up_local_logging(self):
+        """
+        Starts the log file, if one is configured, and starts queueing records for the logging channel. This runs
+        before anything else so that start-up is logged too.
+        """
+        self.log_sink = FileLogSink.from_env()
+        if self.log_sink is not None:
+            self.log_sink.start(logging.getLogger())
+        logging.getLogger('houseofmisfits').addHandler(self.logging_engine)
+
     async def on_ready(self):
         """
         Runs when the bot is connected to Discord and ready to do stuff
         """
         self.guild = self.get_guild(int(os.getenv('BOT_GUILD_ID')))
+        if self.is_set_up:
+            # on_ready runs again every time the gateway reconnects. The modules, their triggers and the dispatcher
+            # are all still in place, so there's nothing to do other than picking up the new guild object.
+            logger.info("Reconnected to Discord")
+            return
+        self.is_set_up = True
         self.loop.set_exception_handler(self.handle_exception)
         await self.set_up_logging()
+        await self.scheduler.start()
         await self.set_up_modules()
+        await self.set_up_dispatcher()
 
     async def set_up_logging(self):
         """
-        When we are connected to Discord, let's go ahead and start logging to the logging channel.
+        When we are connected to Discord, let's go ahead and start logging to the logging channel. Anything logged
+        before now is sent too.
         """
-        await self.logging_engine.setup()
         hom_logger = logging.getLogger('houseofmisfits')
-        hom_logger.addHandler(self.logging_engine)
+        if self.logging_engine not in hom_logger.handlers:
+            hom_logger.addHandler(self.logging_engine)
+        await self.logging_engine.setup()
 
     async def set_up_modules(self):
         """
         Gets all of the modules in the modules package and sets them up
         """
         logger.debug("Setting up modules")
+        start = perf_counter()
+        await self.command_prefix.load()
         # Remember that trigger processing is first-come, first-serve! If there is any kind of conflict, the first
-        # module registered takes precedence.
-        for module_name in modules.__module_list__:
-            module_class: ClassVar[modules.Module] = getattr(modules, module_name)
-            module = module_class(self)
-            await self.add_module(module)
-            logger.debug("Added module: {}".format(module_class.__name__))
+        # module registered takes precedence. Modules start up concurrently, but are still registered in list order.
+        enabled, disabled = await self.get_configs(['modules_enabled', 'modules_disabled'])
+        module_list = []
+        import_timings = {}
+        for spec in modules.discover_modules():
+            if not spec.is_enabled(enabled, disabled):
+                logger.debug("Module {} is disabled".format(spec.name))
+                continue
+            try:
+                module_class: ClassVar[modules.Module] = spec.load()
+            except Exception:
+                logger.error("Could not import module {}".format(spec), exc_info=True)
+                continue
+            import_timings[spec.name] = spec.import_seconds
+            module_list.append(module_class(self))
+        logger.info("Modules imported in {:.2f}s ({})".format(
+            sum(import_timings.values()),
+            ', '.join('{} {:.2f}s'.format(name, seconds)
+                      for name, seconds in sorted(import_timings.items(), key=lambda item: -item[1]))
+        ))
+        timings = await self.add_modules(module_list)
+        logger.info("Modules set up in {:.2f}s ({})".format(
+            perf_counter() - start,
+            ', '.join('{} {:.2f}s'.format(type(module).__name__, seconds)
+                      for module, seconds in sorted(timings.items(), key=lambda item: -item[1]))
+        ))
+
+    async def set_up_dispatcher(self):
+        """
+        Configures the message dispatcher from the config table and starts its workers
+        """
+        workers, queue_size, overload_policy = await self.get_configs(
+            ['dispatch_workers', 'dispatch_queue_size', 'dispatch_overload_policy'],
+            {'dispatch_workers': '4', 'dispatch_queue_size': '100', 'dispatch_overload_policy': MessageDispatcher.DROP}
+        )
+        try:
+            self.dispatcher.configure(workers, queue_size, overload_policy)
+        except ValueError:
+            logger.error("Dispatcher configuration is invalid, using defaults", exc_info=True)
+        self.dispatcher.start()
 
     async def add_module(self, module):
-        self.modules.append(module)
-        async for trigger in module.get_triggers():
-            self.add_trigger(trigger)
+        await self.trigger_registry.add_module(module)
+
+    async def add_modules(self, module_list) -> Dict:
+        """
+        Sets up several modules at once
+        :return: How long each module took to set up, in seconds
+        """
+        return await self.trigger_registry.add_modules(module_list)
 
-    def add_trigger(self, trigger: Trigger):
-        logger.debug("Adding trigger {}".format(str(trigger)))
-        if trigger is not None:
-            self.triggers.append(trigger)
+    async def reload_module(self, module):
+        """
+        Swaps in a fresh set of triggers from a module that is already registered, without touching any other module
+        """
+        await self.trigger_registry.reload_module(module)
+
+    @property
+    def modules(self) -> Tuple:
+        return self.trigger_registry.modules
+
+    @property
+    def triggers(self) -> Tuple[Trigger, ...]:
+        """
+        All of the registered triggers, in the order they take precedence
+        """
+        return self.trigger_registry.triggers
 
     async def on_message(self, message: discord.Message):
         """
-        When a message occurs, this cycles through all of the triggers that have been set up and checks if any of them
-        match.
+        Queues the message with the dispatcher, which calls process_message once a worker is free for its channel.
+        """
+        self.dispatcher.submit(message)
+
+    async def process_message(self, message: discord.Message):
         """
-        for trigger in self.triggers:
-            triggered_fn = await trigger.evaluate(message)
+        When a message occurs, this looks up the triggers that could match it in the current trigger snapshot and checks
+        them in the order they were registered. The message is only parsed once, into a MessageContext that is shared
+        by every trigger and handler.
+
+        How long each trigger evaluation and each handler takes is recorded in `self.stats`.
+        """
+        message_start = perf_counter()
+        context = MessageContext(message, self.command_prefix.value)
+        error = False
+        try:
+            await self.run_triggers(message, context)
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.stats.record_message(perf_counter() - message_start, error)
+
+    async def run_triggers(self, message: discord.Message, context: MessageContext):
+        for trigger in self.trigger_registry.snapshot.candidates(context):
+            start = perf_counter()
+            try:
+                triggered_fn = await trigger.evaluate(message, context)
+            except Exception:
+                self.stats.record_trigger(trigger, perf_counter() - start, error=True)
+                raise
+            self.stats.record_trigger(trigger, perf_counter() - start)
             if triggered_fn:
-                # noinspection PyUnresolvedReferences
-                logger.debug(
-                    "Message ID {0.id} ({0.author.display_name} in {0.channel.id}) triggered module {1}".format(
-                        message, triggered_fn.__module__
+                if logger.isEnabledFor(logging.DEBUG):
+                    # noinspection PyUnresolvedReferences
+                    logger.debug(
+                        "Message ID {0.id} ({0.author.display_name} in {0.channel.id}) triggered module {1}".format(
+                            message, triggered_fn.__module__
+                        )
                     )
-                )
+                start = perf_counter()
+                handled = False
                 # noinspection PyBroadException
                 try:
-                    if await triggered_fn(message):
-                        return
+                    handled = await triggered_fn(message, context)
+                    self.stats.record_handler(triggered_fn, perf_counter() - start)
                 except Exception as e:
+                    self.stats.record_handler(triggered_fn, perf_counter() - start, error=True)
                     logger.error("Trigger threw unhandled exception.", exc_info=True)
-                # noinspection PyUnresolvedReferences
-                logger.debug("Message {0.id}: {1} did not report successful processing. Continuing processing.".format(
-                    message, triggered_fn.__module__
-                ))
+                if handled:
+                    return
+                if logger.isEnabledFor(logging.DEBUG):
+                    # noinspection PyUnresolvedReferences
+                    logger.debug(
+                        "Message {0.id}: {1} did not report successful processing. Continuing processing.".format(
+                            message, triggered_fn.__module__
+                        )
+                    )
 
     async def get_admin_users(self):
         """
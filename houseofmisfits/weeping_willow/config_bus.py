@@ -0,0 +1,96 @@
+import asyncio
+from typing import Callable, Awaitable, Dict, List, Set
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+ConfigCallback = Callable[[str, object], Awaitable]
+
+
+class Subscription:
+    """
+    A handle for a config change callback. Call `unsubscribe` when the callback should stop being run.
+    """
+    def __init__(self, bus: 'ConfigChangeBus', pattern: str, callback: ConfigCallback):
+        self.bus = bus
+        self.pattern = pattern
+        self.callback = callback
+
+    @property
+    def is_prefix(self):
+        return self.pattern.endswith('*')
+
+    def unsubscribe(self):
+        self.bus.unsubscribe(self)
+
+    def __str__(self):
+        return '<Subscription {}: {}>'.format(self.pattern, getattr(self.callback, '__qualname__', self.callback))
+
+
+class ConfigChangeBus:
+    """
+    Runs callbacks when config values change. Subscriptions are indexed by key, and by prefix for patterns ending in
+    `*` (`venting_*`, or just `*` for everything), so publishing a change only touches the subscribers for that key.
+
+    Changes are coalesced: when a key changes several times within `coalesce_seconds`, its subscribers are only called
+    once, with the latest value.
+    """
+    def __init__(self, coalesce_seconds=0.25):
+        self.coalesce_seconds = coalesce_seconds
+        self.exact: Dict[str, List[Subscription]] = {}
+        self.prefixes: Dict[str, List[Subscription]] = {}
+        self.pending: Dict[str, object] = {}
+        self.tasks: Set[asyncio.Task] = set()
+
+    def subscribe(self, pattern: str, callback: ConfigCallback) -> Subscription:
+        subscription = Subscription(self, pattern, callback)
+        if subscription.is_prefix:
+            self.prefixes.setdefault(pattern[:-1], []).append(subscription)
+        else:
+            self.exact.setdefault(pattern, []).append(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        if subscription.is_prefix:
+            index, key = self.prefixes, subscription.pattern[:-1]
+        else:
+            index, key = self.exact, subscription.pattern
+        subscribers = index.get(key, [])
+        if subscription in subscribers:
+            subscribers.remove(subscription)
+            if not subscribers:
+                del index[key]
+
+    def subscribers_for(self, key: str) -> List[Subscription]:
+        subscribers = list(self.exact.get(key, ()))
+        if self.prefixes:
+            for end in range(len(key) + 1):
+                subscribers += self.prefixes.get(key[:end], ())
+        return subscribers
+
+    def publish(self, key: str, value):
+        """
+        Records that a config value changed. Subscribers are called once the coalescing window for the key has passed.
+        """
+        first_change = key not in self.pending
+        self.pending[key] = value
+        if first_change:
+            asyncio.get_event_loop().call_later(self.coalesce_seconds, self.flush, key)
+
+    def flush(self, key: str):
+        value = self.pending.pop(key, None)
+        loop = asyncio.get_event_loop()
+        for subscription in self.subscribers_for(key):
+            task = loop.create_task(subscription.callback(key, value))
+            self.tasks.add(task)
+            task.add_done_callback(self.on_callback_done)
+
+    def on_callback_done(self, task: asyncio.Task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error("Config change callback failed", exc_info=task.exception())
+
+    def __len__(self):
+        return sum(len(subscribers) for subscribers in self.exact.values()) + \
+            sum(len(subscribers) for subscribers in self.prefixes.values())
@@ -0,0 +1,207 @@
+import re
+from datetime import time, tzinfo
+from typing import Callable, Dict, Any, Union, FrozenSet
+
+import pytz
+
+
+class ConfigValueError(ValueError):
+    """
+    Raised when a value can't be used for a config key
+    """
+    pass
+
+
+def snowflake(raw: str) -> int:
+    """
+    A Discord ID. Channel, role and user mentions are accepted too.
+    """
+    match = re.fullmatch(r'(?:<(?:#|@&|@!?))?(\d+)>?', raw.strip())
+    if match is None:
+        raise ConfigValueError("`{}` is not a Discord ID".format(raw))
+    return int(match.group(1))
+
+
+def positive_int(raw: str) -> int:
+    try:
+        value = int(raw)
+    except ValueError:
+        raise ConfigValueError("`{}` is not a whole number".format(raw))
+    if value < 1:
+        raise ConfigValueError("`{}` must be at least 1".format(raw))
+    return value
+
+
+DURATION_UNITS = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+
+def duration(raw: str) -> int:
+    """
+    A number of seconds. A unit may be given, like `90s`, `5m`, `2h` or `1d`.
+    """
+    match = re.fullmatch(r'(\d+)\s*([smhd]?)', raw.strip().lower())
+    if match is None:
+        raise ConfigValueError("`{}` is not a duration. Try something like `300`, `5m` or `2h`.".format(raw))
+    return int(match.group(1)) * DURATION_UNITS[match.group(2) or 's']
+
+
+def one_of(*choices: str, case: Callable[[str], str] = str.lower) -> Callable[[str], str]:
+    def parse(raw: str) -> str:
+        value = case(raw.strip())
+        if value not in choices:
+            raise ConfigValueError("`{}` should be one of {}".format(raw, ', '.join(choices)))
+        return value
+    return parse
+
+
+def prefix(raw: str) -> str:
+    if not raw or ' ' in raw:
+        raise ConfigValueError("The command prefix can't be empty or contain spaces")
+    return raw
+
+
+def time_of_day(raw: str) -> time:
+    """
+    A time of day on a 24 hour clock, like `06:00` or `18:30`
+    """
+    match = re.fullmatch(r'(\d{1,2}):(\d{2})', raw.strip())
+    if match is None or int(match.group(1)) > 23 or int(match.group(2)) > 59:
+        raise ConfigValueError("`{}` is not a time. Try something like `06:00` or `18:30`.".format(raw))
+    return time(int(match.group(1)), int(match.group(2)))
+
+
+def format_time_of_day(value: time) -> str:
+    return value.strftime('%H:%M')
+
+
+def timezone_name(raw: str) -> tzinfo:
+    """
+    A timezone from the tz database, like `America/New_York`
+    """
+    try:
+        return pytz.timezone(raw.strip())
+    except pytz.UnknownTimeZoneError:
+        raise ConfigValueError("`{}` is not a timezone. Try something like `America/New_York`.".format(raw))
+
+
+def name_set(raw: str) -> FrozenSet[str]:
+    """
+    A list of names, separated by commas or spaces
+    """
+    return frozenset(name for name in re.split(r'[\s,]+', raw) if name)
+
+
+def format_name_set(names) -> str:
+    return ', '.join(sorted(names))
+
+
+def rate_map(raw: str) -> Dict[str, float]:
+    """
+    Names with a rate between 0 and 1 each, like `some.logger=0.1, other.logger=0.5`
+    """
+    rates = {}
+    for pair in re.split(r'[\s,]+', raw):
+        if not pair:
+            continue
+        name, _, rate = pair.partition('=')
+        try:
+            rates[name] = float(rate)
+        except ValueError:
+            raise ConfigValueError("`{}` should look like `name=0.5`".format(pair))
+        if not 0 <= rates[name] <= 1:
+            raise ConfigValueError("The rate for `{}` should be between 0 and 1".format(name))
+    return rates
+
+
+def format_rate_map(rates) -> str:
+    return ', '.join('{}={}'.format(name, rate) for name, rate in sorted(rates.items()))
+
+
+class ConfigKey:
+    """
+    Declares what a config key holds. Values are parsed once, when they are loaded or changed, so the rest of the bot
+    only ever sees the parsed value.
+    """
+    def __init__(self, name: str, parser: Callable[[str], Any] = str, default: Union[str, None] = None,
+                 formatter: Callable[[Any], str] = str):
+        self.name = name
+        self.parser = parser
+        self.default = default
+        self.formatter = formatter
+
+    def parse(self, raw: Union[str, None]):
+        if raw is None:
+            return None
+        return self.parser(str(raw))
+
+    def to_raw(self, value) -> Union[str, None]:
+        """
+        Validates a value and turns it into the string that gets stored in the config table. The value can be a raw
+        string or an already parsed value.
+        """
+        if value is None:
+            return None
+        if isinstance(value, str):
+            return self.formatter(self.parse(value))
+        raw = self.formatter(value)
+        # Still parsed, so a parsed value that's out of range is refused like the same raw string would be
+        self.parse(raw)
+        return raw
+
+    @property
+    def default_value(self):
+        return self.parse(self.default)
+
+
+CONFIG_SCHEMA: Dict[str, ConfigKey] = {key.name: key for key in [
+    ConfigKey('command_prefix', prefix, '.'),
+    ConfigKey('logging_channel', snowflake),
+    ConfigKey('log_level', one_of('DEBUG', 'INFO', 'WARN', 'ERROR', 'CRITICAL', case=str.upper), 'INFO'),
+    ConfigKey('log_dedup_seconds', duration, '60'),
+    ConfigKey('log_sampling', rate_map, '', format_rate_map),
+    ConfigKey('venting_channel', snowflake),
+    ConfigKey('venting_deletion_seconds', duration, '300'),
+    ConfigKey('participant_role', snowflake),
+    ConfigKey('event_timezone', timezone_name, 'America/New_York'),
+    ConfigKey('event_window_start', time_of_day, '06:00', format_time_of_day),
+    ConfigKey('event_window_end', time_of_day, '18:00', format_time_of_day),
+    ConfigKey('support_role_id', snowflake),
+    ConfigKey('support_category', snowflake),
+    ConfigKey('support_archive_category', snowflake),
+    ConfigKey('dispatch_workers', positive_int, '4'),
+    ConfigKey('dispatch_queue_size', positive_int, '100'),
+    ConfigKey('dispatch_overload_policy', one_of('drop', 'shed'), 'drop'),
+    ConfigKey('modules_enabled', name_set, '', format_name_set),
+    ConfigKey('modules_disabled', name_set, '', format_name_set),
+]}
+
+
+def parse_config(key: str, raw: Union[str, None]):
+    """
+    Parses a raw config value. Keys that aren't in the schema are handed back as they are.
+    """
+    if key not in CONFIG_SCHEMA:
+        return raw
+    return CONFIG_SCHEMA[key].parse(raw)
+
+
+def to_raw_config(key: str, value) -> Union[str, None]:
+    """
+    Validates a config value and gets the string to store for it
+    :raises ConfigValueError: If the value isn't valid for the key
+    """
+    if len(key) > 40:
+        raise ConfigValueError("Config names can be at most 40 characters")
+    if key in CONFIG_SCHEMA:
+        raw = CONFIG_SCHEMA[key].to_raw(value)
+    else:
+        raw = None if value is None else str(value)
+    if raw is not None and len(raw) > 100:
+        raise ConfigValueError("Config values can be at most 100 characters")
+    return raw
+
+
+def default_config(key: str):
+    if key not in CONFIG_SCHEMA:
+        return None
+    return CONFIG_SCHEMA[key].default_value
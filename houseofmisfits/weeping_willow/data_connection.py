@@ -1,22 +1,37 @@
-from typing import List, Tuple, Callable, Awaitable
+from contextlib import asynccontextmanager
+from time import perf_counter
+from typing import List, Dict, Union, Iterable, Mapping, AsyncIterator
 
 import asyncpg
 import asyncio
 import logging
 import os
 
-logging.basicConfig()
+from houseofmisfits.weeping_willow.config_schema import parse_config, to_raw_config, default_config, \
+    ConfigValueError
+from houseofmisfits.weeping_willow.config_bus import ConfigChangeBus, ConfigCallback, Subscription
+from houseofmisfits.weeping_willow.database import PreparedConnection, TimedConnection, Statements
+from houseofmisfits.weeping_willow.stats import DatabaseStats
+
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 
 class WeepingWillowDataConnection:
+    CONFIG_CHANGE_CHANNEL = 'bot_config_changed'
+    # Backoff for re-opening the LISTEN connection after it drops
+    LISTEN_RETRY_SECONDS = 5
+    LISTEN_RETRY_MAX_SECONDS = 300
 
     def __init__(self, client):
         self.client = client
         self.pool = None
+        self.listener = None
+        self.reconnect_task: Union[asyncio.Task, None] = None
         self.is_connected = False
-        self.config_change_actions: List[Tuple[str, Callable]] = []
+        self.config: Dict[str, Union[str, None]] = {}
+        self.values: Dict[str, object] = {}
+        self.config_changes = ConfigChangeBus()
+        self.stats = DatabaseStats()
 
     def connect(self):
         logger.debug("Waiting to continue until connected to database")
@@ -26,6 +41,32 @@ class WeepingWillowDataConnection:
         loop.run_until_complete(future)
         self.pool = future.result()
         logger.debug("Connection pool made!")
+        loop.run_until_complete(self.load_config())
+        listening = loop.run_until_complete(self.listen_for_config_changes())
+        self.is_connected = True
+        if not listening:
+            self.reconnect_listener()
+
+    @staticmethod
+    def connection_args():
+        return {
+            'database': os.getenv("POSTGRES_USER"),
+            'user': os.getenv("POSTGRES_USER"),
+            'password': os.getenv("POSTGRES_PASSWORD"),
+            'host': os.getenv("POSTGRES_HOST")
+        }
+
+    @staticmethod
+    def pool_args():
+        """
+        The pool opens connections as they are needed, up to the max size, and closes connections that have been idle
+        for a while, down to the min size.
+        """
+        return {
+            'min_size': int(os.getenv("POSTGRES_POOL_MIN_SIZE", 2)),
+            'max_size': int(os.getenv("POSTGRES_POOL_MAX_SIZE", 10)),
+            'max_inactive_connection_lifetime': float(os.getenv("POSTGRES_POOL_IDLE_SECONDS", 120))
+        }
 
     async def create_connection_pool(self, future):
         """
@@ -33,70 +74,277 @@ class WeepingWillowDataConnection:
         """
         try:
             pool = await asyncpg.create_pool(
-                database=os.getenv("POSTGRES_USER"),
-                user=os.getenv("POSTGRES_USER"),
-                password=os.getenv("POSTGRES_PASSWORD"),
-                host=os.getenv("POSTGRES_HOST"),
-                min_size=3,
-                max_size=5
+                **self.connection_args(),
+                **self.pool_args(),
+                connection_class=PreparedConnection,
+                init=self.init_connection
             )
             future.set_result(pool)
         except Exception as e:
             future.set_exception(e)
         future.done()
 
+    @staticmethod
+    async def init_connection(conn: PreparedConnection):
+        await conn.prepare_statements()
+
+    @asynccontextmanager
+    async def acquire(self) -> AsyncIterator[TimedConnection]:
+        """
+        Acquires a connection from the pool. The time spent waiting for it and the time every query takes are recorded
+        in `stats`.
+        """
+        start = perf_counter()
+        async with self.pool.acquire() as conn:
+            self.stats.record_acquire(perf_counter() - start)
+            yield TimedConnection(conn, self.stats)
+
+    def pool_usage(self) -> Dict[str, int]:
+        """
+        Gets how many connections the pool has open, how many of them are idle, and how many it can open at most
+        """
+        if self.pool is None:
+            return {}
+        return {
+            'size': self.pool.get_size(),
+            'idle': self.pool.get_idle_size(),
+            'max': self.pool.get_max_size()
+        }
+
+    async def expire_connections(self):
+        """
+        Replaces every pooled connection once it is released. Run this after changing the schema, since statements
+        prepared against the old schema can't be used anymore.
+        """
+        await self.pool.expire_connections()
+
     async def close(self):
+        self.is_connected = False
+        if self.reconnect_task is not None:
+            self.reconnect_task.cancel()
+            self.reconnect_task = None
+        if self.listener is not None:
+            await self.listener.close()
+            self.listener = None
         await self.pool.close()
 
-    async def get_config(self, key, default=None):
+    async def load_config(self):
         """
-        Gets a raw value from the config table.
-        :param key: The name of the configuration to get
-        :param default: Sets the configuration value if it has not already been set
-        :return: The configuration value, or None if it's not set and no default has been provided.
+        Reads the whole config table into memory and parses every value. After this, config reads never touch the
+        database.
         """
-        async with self.pool.acquire() as conn:
+        async with self.acquire() as conn:
             try:
-                result = await conn.fetchrow("SELECT config_val FROM bot_config WHERE config_key = $1", key)
+                rows = await conn.fetch("SELECT config_key, config_val FROM bot_config")
             except asyncpg.UndefinedTableError:
                 await self.build_config_table(conn)
-                return await self.get_config(key, default)
-            except asyncpg.SyntaxOrAccessError:
-                logger.error("Could not get config!", exc_info=True)
-                return None
+                rows = []
+        self.config = {}
+        self.values = {}
+        for row in rows:
+            self.cache_config(row['config_key'], row['config_val'])
+        logger.debug("Loaded {} config values".format(len(self.config)))
+
+    def cache_config(self, key, raw):
+        """
+        Stores a raw config value in the cache along with its parsed value. A cleared value, or a stored value that
+        doesn't fit the schema, is replaced by the key's default, so a bad row can't crash the handlers that use it.
+        """
+        self.config[key] = raw
+        if raw is None:
+            self.values[key] = default_config(key)
+            return
+        try:
+            self.values[key] = parse_config(key, raw)
+        except ConfigValueError as e:
+            logger.error("Config {} has an invalid value '{}' ({}). Using the default instead.".format(key, raw, e))
+            self.values[key] = default_config(key)
+
+    async def listen_for_config_changes(self) -> bool:
+        """
+        Opens a dedicated connection that LISTENs for changes to the config table, so that changes made by another
+        process or by hand in SQL make it into the cache too. If the connection drops, it is opened again.
+        :return: Whether the bot is listening
+        """
+        listener = None
+        try:
+            listener = await asyncpg.connect(**self.connection_args())
+            listener.add_termination_listener(self.on_listener_lost)
+            await listener.add_listener(WeepingWillowDataConnection.CONFIG_CHANGE_CHANNEL, self.on_notification)
+        except (OSError, asyncpg.PostgresError):
+            logger.error("Could not listen for config changes. Changes made outside the bot will not be seen until "
+                         "listening works again.", exc_info=True)
+            if listener is not None:
+                listener.terminate()
+            return False
+        self.listener = listener
+        return True
+
+    def on_listener_lost(self, connection):
+        if connection is not self.listener or not self.is_connected:
+            # Closed on purpose
+            return
+        logger.warning("Lost the connection listening for config changes, reconnecting")
+        self.listener = None
+        self.reconnect_listener()
 
-            if result is None and default is not None:
-                logger.warning("Config value {} does not exist, setting to default ({})".format(key, default))
-                await self.set_config(key, default)
-                return default
-            if result is None:
-                return None
-            return result['config_val']
+    def reconnect_listener(self):
+        if self.reconnect_task is None or self.reconnect_task.done():
+            self.reconnect_task = asyncio.get_event_loop().create_task(self.keep_reconnecting_listener())
+
+    async def keep_reconnecting_listener(self):
+        """
+        Opens the LISTEN connection again, backing off between tries, then reloads the whole config, since any
+        changes made while the bot wasn't listening were missed
+        """
+        delay = WeepingWillowDataConnection.LISTEN_RETRY_SECONDS
+        while self.is_connected:
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, WeepingWillowDataConnection.LISTEN_RETRY_MAX_SECONDS)
+            if self.listener is None and not await self.listen_for_config_changes():
+                continue
+            try:
+                await self.reload_config()
+            except (OSError, asyncpg.PostgresError):
+                logger.error("Could not reload the config after reconnecting", exc_info=True)
+                continue
+            logger.info("Listening for config changes again")
+            return
+
+    async def reload_config(self):
+        """
+        Reads the whole config table again and lets subscribers know about every value that changed
+        """
+        old = self.config
+        await self.load_config()
+        changed = [key for key in set(old) | set(self.config) if old.get(key) != self.config.get(key)]
+        for key in changed:
+            self.notify_config_change(key, self.values[key] if key in self.values else default_config(key))
+        if changed:
+            logger.info("Config values changed while not listening: {}".format(', '.join(sorted(changed))))
+
+    def on_notification(self, connection, pid, channel, payload):
+        asyncio.get_event_loop().create_task(self.refresh_config(payload))
+
+    async def refresh_config(self, key):
+        """
+        Re-reads a single config value after it was changed in the database
+        """
+        async with self.acquire() as conn:
+            result = await conn.fetchrow(Statements.CONFIG_VALUE, key)
+        if result is None:
+            if key not in self.config:
+                return
+            del self.config[key]
+            del self.values[key]
+            raw = None
+        else:
+            raw = result['config_val']
+            if key in self.config and self.config[key] == raw:
+                # Already up to date. This is usually a change this process made itself.
+                return
+            self.cache_config(key, raw)
+        logger.info("Config {} was changed outside the bot, now '{}'".format(key, raw))
+        self.notify_config_change(key, self.values[key] if key in self.values else default_config(key))
+
+    async def get_config(self, key, default=None):
+        """
+        Gets a parsed value from the config cache.
+        :param key: The name of the configuration to get
+        :param default: Sets the configuration value if it has not already been set
+        :return: The configuration value, or None if it's not set and no default has been provided. Keys in the config
+                 schema fall back to their declared default without storing it.
+        """
+        if key in self.values:
+            return self.values[key]
+        if default is not None:
+            logger.warning("Config value {} does not exist, setting to default ({})".format(key, default))
+            await self.set_config(key, default)
+            return self.values.get(key)
+        return default_config(key)
+
+    def get_raw_config(self, key) -> Union[str, None]:
+        """
+        Gets the value of a config key exactly as it is stored in the config table
+        """
+        return self.config.get(key)
+
+    async def get_configs(self, keys: Iterable[str], defaults: Mapping[str, str] = None) -> List:
+        """
+        Gets several parsed values from the config cache. Any defaults that need to be stored are written in one query.
+        :param keys: The names of the configurations to get
+        :param defaults: Default values for some or all of the keys, set if the key has not already been set
+        :return: The configuration values, in the same order as the keys
+        """
+        keys = list(keys)
+        defaults = defaults or {}
+        missing = {key: defaults[key] for key in keys
+                   if key not in self.values and defaults.get(key) is not None}
+        if missing:
+            logger.warning("Config values {} do not exist, setting to defaults".format(', '.join(missing)))
+            await self.set_configs(missing)
+        return [self.values[key] if key in self.values else default_config(key) for key in keys]
 
     async def set_config(self, key, value):
         """
-        Sets the configuration value by deleting the existing value and replacing it
+        Validates the value against the config schema, stores it with a single upsert, then updates the cache
         :param key: The name of the configuration to set
         :param value: The value to set the configuration to
+        :raises ConfigValueError: If the value isn't valid for the key. Nothing is stored in that case.
         """
-        async with self.pool.acquire() as conn, conn.transaction():
+        raw = to_raw_config(key, value)
+        async with self.acquire() as conn:
             try:
-                await conn.execute("DELETE FROM bot_config WHERE config_key = $1", key)
-                await conn.execute("INSERT INTO bot_config (config_key, config_val) VALUES ($1, $2)", key, value)
-                logger.debug("Config {} set to '{}'".format(key, value))
+                await conn.execute(
+                    "INSERT INTO bot_config (config_key, config_val) VALUES ($1, $2) "
+                    "ON CONFLICT (config_key) DO UPDATE SET config_val = EXCLUDED.config_val",
+                    key, raw
+                )
+                self.cache_config(key, raw)
+                logger.debug("Config {} set to '{}'".format(key, raw))
             except asyncpg.SyntaxOrAccessError:
                 logger.critical("Could not set the requested configuration value. The bot may not function correctly.")
-            actions = [action for watched_key, action in self.config_change_actions if key == watched_key]
-            for action in actions:
-                self.client.loop.create_task(action(key, value))
+        self.notify_config_change(key, self.values.get(key))
+
+    async def set_configs(self, values: Mapping[str, Union[str, None]]):
+        """
+        Validates and sets several configuration values in one round trip, then updates the cache
+        :param values: The configuration names and the values to set them to
+        :raises ConfigValueError: If any of the values isn't valid for its key. Nothing is stored in that case.
+        """
+        if not values:
+            return
+        raw_values = {key: to_raw_config(key, value) for key, value in values.items()}
+        async with self.acquire() as conn:
+            try:
+                await conn.execute(
+                    "INSERT INTO bot_config (config_key, config_val) "
+                    "SELECT * FROM unnest($1::varchar[], $2::varchar[]) "
+                    "ON CONFLICT (config_key) DO UPDATE SET config_val = EXCLUDED.config_val",
+                    list(raw_values.keys()), list(raw_values.values())
+                )
+                for key, raw in raw_values.items():
+                    self.cache_config(key, raw)
+                logger.debug("Configs set: {}".format(
+                    ', '.join("{} = '{}'".format(*item) for item in raw_values.items())
+                ))
+            except asyncpg.SyntaxOrAccessError:
+                logger.critical("Could not set the requested configuration values. The bot may not function correctly.")
+        for key in raw_values:
+            self.notify_config_change(key, self.values.get(key))
+
+    def notify_config_change(self, key, value):
+        self.config_changes.publish(key, value)
 
-    async def on_config_change(self, key, callback: Callable[[str, str], Awaitable]):
+    async def on_config_change(self, key, callback: ConfigCallback) -> Subscription:
         """
         Configures a coroutine to run when a specific configuration value is set
-        :param key: The configuration key to watch
-        :param callback: A coroutine with two string args (key and value) to run when the config value is set
+        :param key: The configuration key to watch. A key ending in `*` watches every key starting with what comes
+                    before it.
+        :param callback: A coroutine with two args (key and parsed value) to run when the config value is set
+        :return: A subscription that can be used to stop watching the key
         """
-        self.config_change_actions.append((key, callback))
+        return self.config_changes.subscribe(key, callback)
 
     async def build_config_table(self, conn):
         """
@@ -0,0 +1,146 @@
+import re
+from time import perf_counter
+from typing import Dict, Union
+
+import asyncpg
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class Statements:
+    """
+    The queries that run on every message or on every event participant. Every pooled connection prepares these once,
+    when it is opened, so running them later skips parsing and planning. Use these constants instead of writing the
+    SQL out again, because statements are matched by their text.
+    """
+    CONFIG_VALUE = "SELECT config_val FROM bot_config WHERE config_key = $1"
+    EVENT_SCHEDULE = "SELECT day_of_week, channel_id FROM event_channels"
+    EVENT_PARTICIPANTS = "SELECT member_id FROM event_participants WHERE participation_dt = $1"
+    ADD_EVENT_PARTICIPANTS = (
+        "INSERT INTO event_participants (participation_dt, member_id, message_id) "
+        "SELECT * FROM unnest($1::date[], $2::bigint[], $3::bigint[]) "
+        "ON CONFLICT (participation_dt, member_id) DO NOTHING"
+    )
+    OPEN_SUPPORT_SESSION = (
+        "SELECT * FROM support_session"
+        "  WHERE member_id = $1 "
+        "  AND session_status NOT IN ('Closed', 'Cancelled')"
+        "  AND session_dt > CURRENT_DATE - 2"
+    )
+    SUPPORT_CHANNEL_FOR_MEMBER = "SELECT channel_id FROM support_session_channels WHERE member_id = $1"
+    SUPPORT_MEMBER_FOR_CHANNEL = "SELECT member_id FROM support_session_channels WHERE channel_id = $1"
+    SCHEDULED_DELETIONS = "SELECT message_id, channel_id, delete_at FROM scheduled_deletions"
+    SCHEDULE_DELETION = (
+        "INSERT INTO scheduled_deletions (message_id, channel_id, delete_at) VALUES ($1, $2, $3) "
+        "ON CONFLICT (message_id) DO NOTHING"
+    )
+    UNSCHEDULE_DELETIONS = "DELETE FROM scheduled_deletions WHERE message_id = ANY($1::bigint[])"
+    HISTORY_CHECKPOINTS = "SELECT scanner, channel_id, message_id FROM history_checkpoints"
+    SAVE_HISTORY_CHECKPOINTS = (
+        "INSERT INTO history_checkpoints (scanner, channel_id, message_id) "
+        "SELECT * FROM unnest($1::varchar[], $2::bigint[], $3::bigint[]) "
+        "ON CONFLICT (scanner, channel_id) "
+        "DO UPDATE SET message_id = GREATEST(history_checkpoints.message_id, EXCLUDED.message_id)"
+    )
+    SCHEDULED_JOBS = "SELECT job_id, kind, run_at, payload, attempts FROM scheduled_jobs"
+    ADD_SCHEDULED_JOB = "INSERT INTO scheduled_jobs (kind, run_at, payload) VALUES ($1, $2, $3) RETURNING job_id"
+    REMOVE_SCHEDULED_JOB = "DELETE FROM scheduled_jobs WHERE job_id = $1"
+    RETRY_SCHEDULED_JOB = "UPDATE scheduled_jobs SET run_at = $2, attempts = $3 WHERE job_id = $1"
+
+    @classmethod
+    def all(cls) -> Dict[str, str]:
+        """
+        Gets every prepared statement's SQL, keyed by its name
+        """
+        return {name.lower(): value for name, value in vars(cls).items() if name.isupper()}
+
+
+class PreparedConnection(asyncpg.Connection):
+    """
+    A pooled connection that keeps the statements it has prepared, keyed by their SQL
+    """
+    def __init__(self, *args, **kwargs):
+        super(PreparedConnection, self).__init__(*args, **kwargs)
+        self.prepared_statements: Dict[str, asyncpg.prepared_stmt.PreparedStatement] = {}
+
+    async def prepare_statements(self):
+        for name, query in Statements.all().items():
+            try:
+                self.prepared_statements[query] = await self.prepare(query)
+            except asyncpg.SyntaxOrAccessError as e:
+                # A table or column doesn't exist yet, because the database hasn't been upgraded. The statement will be
+                # prepared the first time it is run instead.
+                logger.debug("Not preparing {} yet: {}".format(name, e))
+
+    async def get_prepared_statement(self, query) -> Union[asyncpg.prepared_stmt.PreparedStatement, None]:
+        """
+        Gets the prepared statement for a query, or None if it isn't one of the `Statements`
+        """
+        statement = self.prepared_statements.get(query)
+        if statement is None and query in STATEMENT_NAMES:
+            statement = self.prepared_statements[query] = await self.prepare(query)
+        return statement
+
+
+STATEMENT_NAMES = {query: name for name, query in Statements.all().items()}
+
+
+class TimedConnection:
+    """
+    Wraps a pooled connection so that every query it runs is timed into the data connection's stats. Queries that are
+    one of the `Statements` run through the connection's prepared statement. Anything else is passed straight through
+    to the connection.
+    """
+    def __init__(self, connection: PreparedConnection, stats):
+        self.connection = connection
+        self.stats = stats
+
+    async def run(self, method, query, *args, **kwargs):
+        start = perf_counter()
+        error = False
+        try:
+            statement = await self.connection.get_prepared_statement(query)
+            if statement is None:
+                return await getattr(self.connection, method)(query, *args, **kwargs)
+            if method == 'execute':
+                await statement.fetch(*args, **kwargs)
+                return statement.get_statusmsg()
+            return await getattr(statement, method)(*args, **kwargs)
+        except Exception:
+            error = True
+            raise
+        finally:
+            self.stats.record_query(statement_label(query), perf_counter() - start, error)
+
+    async def execute(self, query, *args, **kwargs):
+        return await self.run('execute', query, *args, **kwargs)
+
+    async def fetch(self, query, *args, **kwargs):
+        return await self.run('fetch', query, *args, **kwargs)
+
+    async def fetchrow(self, query, *args, **kwargs):
+        return await self.run('fetchrow', query, *args, **kwargs)
+
+    async def fetchval(self, query, *args, **kwargs):
+        return await self.run('fetchval', query, *args, **kwargs)
+
+    def __getattr__(self, item):
+        return getattr(self.connection, item)
+
+
+labels: Dict[str, str] = {}
+
+
+def statement_label(query: str) -> str:
+    """
+    Gets the name that a query's timings are recorded under. Prepared statements use their name, anything else uses
+    the start of its SQL.
+    """
+    label = labels.get(query)
+    if label is None:
+        label = STATEMENT_NAMES.get(query) or re.sub(r'\s+', ' ', query).strip()[:48]
+        if len(labels) < 1000:
+            labels[query] = label
+    return label
@@ -0,0 +1,156 @@
+import asyncio
+from collections import deque
+from typing import Callable, Awaitable, Deque, Dict, List
+
+import discord
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class MessageDispatcher:
+    """
+    Hands incoming messages to a fixed number of workers. Each channel gets its own bounded queue, and only one worker
+    handles a channel at a time, so messages in a channel are processed in the order they arrived while different
+    channels are processed in parallel.
+
+    When a channel's queue is full, the overload policy decides what happens to new messages for that channel:
+    `drop` discards them, and `shed` moves them to a single slow-path worker with its own bounded queue. Shed
+    messages are still processed, but not necessarily in order with the rest of their channel.
+
+    A worker is busy until its message's handler returns, so handlers should return quickly. Commands that wait for
+    someone to confirm or that go through a whole role start their own task for the slow part.
+    """
+    DROP = 'drop'
+    SHED = 'shed'
+    OVERLOAD_POLICIES = (DROP, SHED)
+
+    def __init__(self, handler: Callable[[discord.Message], Awaitable], workers=4, queue_size=100,
+                 overload_policy=DROP):
+        self.handler = handler
+        self.worker_count = None
+        self.queue_size = None
+        self.overload_policy = None
+        self.configure(workers, queue_size, overload_policy)
+        self.queues: Dict[int, Deque[discord.Message]] = {}
+        self.ready: Deque[int] = deque()
+        self.ready_event = asyncio.Event()
+        self.slow_queue: Deque[discord.Message] = deque()
+        self.slow_event = asyncio.Event()
+        self.tasks: List[asyncio.Task] = []
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+        self.shed = 0
+        self.peak_depth = 0
+
+    def configure(self, workers, queue_size, overload_policy):
+        """
+        Changes the dispatcher settings. The worker count only takes effect the next time the dispatcher starts.
+        """
+        if overload_policy not in MessageDispatcher.OVERLOAD_POLICIES:
+            raise ValueError("Unknown overload policy {}".format(overload_policy))
+        workers, queue_size = int(workers), int(queue_size)
+        self.worker_count = max(1, workers)
+        self.queue_size = max(1, queue_size)
+        self.overload_policy = overload_policy
+
+    def start(self):
+        """
+        Starts the workers. Messages submitted before the dispatcher starts wait in their queues.
+        """
+        if self.tasks:
+            return
+        loop = asyncio.get_event_loop()
+        self.tasks = [loop.create_task(self.run_worker()) for _ in range(self.worker_count)]
+        self.tasks.append(loop.create_task(self.run_slow_worker()))
+        logger.info("Message dispatcher started with {} workers, queue size {} and overload policy '{}'".format(
+            self.worker_count, self.queue_size, self.overload_policy
+        ))
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def submit(self, message: discord.Message):
+        """
+        Queues a message to be handled
+        """
+        self.received += 1
+        channel_id = message.channel.id
+        queue = self.queues.get(channel_id)
+        if queue is None:
+            queue = self.queues[channel_id] = deque()
+            self.ready.append(channel_id)
+            self.ready_event.set()
+        elif len(queue) >= self.queue_size:
+            self.overload(message)
+            return
+        queue.append(message)
+        if len(queue) > self.peak_depth:
+            self.peak_depth = len(queue)
+
+    def overload(self, message: discord.Message):
+        if self.overload_policy == MessageDispatcher.SHED and len(self.slow_queue) < self.queue_size:
+            self.shed += 1
+            self.slow_queue.append(message)
+            self.slow_event.set()
+            return
+        self.dropped += 1
+        if self.dropped % 100 == 1:
+            # Only warn every so often, otherwise a raid turns into a flood of log messages too
+            logger.warning("Dispatch queue for channel {} is full, dropping message {} ({} dropped so far)".format(
+                message.channel.id, message.id, self.dropped
+            ))
+
+    async def run_worker(self):
+        while True:
+            while not self.ready:
+                self.ready_event.clear()
+                await self.ready_event.wait()
+            channel_id = self.ready.popleft()
+            queue = self.queues[channel_id]
+            await self.handle(queue.popleft())
+            if queue:
+                # Go to the back of the line so one busy channel doesn't starve the others
+                self.ready.append(channel_id)
+                self.ready_event.set()
+            else:
+                del self.queues[channel_id]
+
+    async def run_slow_worker(self):
+        while True:
+            while not self.slow_queue:
+                self.slow_event.clear()
+                await self.slow_event.wait()
+            await self.handle(self.slow_queue.popleft())
+
+    async def handle(self, message: discord.Message):
+        # noinspection PyBroadException
+        try:
+            await self.handler(message)
+        except Exception:
+            logger.error("Unhandled exception while dispatching message {}".format(message.id), exc_info=True)
+        finally:
+            self.processed += 1
+
+    def queue_depths(self) -> Dict[int, int]:
+        """
+        The number of messages waiting in each channel's queue
+        """
+        return {channel_id: len(queue) for channel_id, queue in self.queues.items()}
+
+    def counters(self) -> Dict[str, int]:
+        return {
+            'received': self.received,
+            'processed': self.processed,
+            'dropped': self.dropped,
+            'shed': self.shed,
+            'queued': sum(len(queue) for queue in self.queues.values()),
+            'slow_queued': len(self.slow_queue),
+            'active_channels': len(self.queues),
+            'peak_depth': self.peak_depth
+        }
@@ -0,0 +1,106 @@
+from typing import Awaitable, Callable, Dict, Tuple, Union
+
+import asyncpg
+import discord
+
+from houseofmisfits.weeping_willow.database import Statements
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class HistoryScanner:
+    """
+    Reads channel history to catch up on messages the bot missed. Every scanner (like `venting` or `event`) keeps a
+    checkpoint per channel: the newest message a scan has handled. Messages handled as they come in don't move it,
+    since that would skip anything missed while the bot was disconnected. A scan only asks Discord for the messages
+    after the checkpoint, and keeps paging until it has all of them, so catching up costs as much as what was missed
+    and nothing is skipped on a busy day.
+
+    Checkpoints are saved in the `history_checkpoints` table.
+    """
+    # How many messages a scan handles between saving its checkpoint, so a scan that is cut short doesn't start over
+    SAVE_EVERY = 100
+
+    def __init__(self, client):
+        from houseofmisfits.weeping_willow import WeepingWillowClient
+        self.client: WeepingWillowClient = client
+        self.checkpoints: Union[Dict[Tuple[str, int], int], None] = None
+        self.unsaved: Dict[Tuple[str, int], int] = {}
+
+    async def load(self):
+        if self.checkpoints is not None:
+            return
+        try:
+            async with self.client.acquire_data_connection() as conn:
+                rows = await conn.fetch(Statements.HISTORY_CHECKPOINTS)
+        except asyncpg.PostgresError:
+            logger.error("Could not load history checkpoints, scans will start from their defaults", exc_info=True)
+            rows = []
+        self.checkpoints = {(row['scanner'], row['channel_id']): row['message_id'] for row in rows}
+
+    async def checkpoint(self, scanner: str, channel_id: int) -> Union[int, None]:
+        await self.load()
+        return self.checkpoints.get((scanner, channel_id))
+
+    def mark_seen(self, scanner: str, channel_id: int, message_id: int):
+        """
+        Moves a checkpoint forward to a message a scan has handled. Checkpoints never move backwards.
+        """
+        if self.checkpoints is None:
+            # Not loaded yet. The next scan will just look at a little more history.
+            return
+        key = (scanner, channel_id)
+        if message_id > self.checkpoints.get(key, 0):
+            self.checkpoints[key] = message_id
+            self.unsaved[key] = message_id
+
+    async def scan(self, scanner: str, channel: discord.abc.Messageable,
+                   callback: Callable[[discord.Message], Awaitable], after: int = None, before: int = None) -> int:
+        """
+        Calls `callback` with every message in a channel after the scanner's checkpoint, oldest first.
+        :param scanner: The name the checkpoint is kept under
+        :param channel: The channel to scan
+        :param callback: A coroutine to run for each message
+        :param after: A snowflake to start from, if it is later than the checkpoint or there is no checkpoint yet
+        :param before: A snowflake to stop at
+        :return: How many messages were scanned
+        """
+        checkpoint = await self.checkpoint(scanner, channel.id)
+        start = max(snowflake for snowflake in (checkpoint, after, 0) if snowflake is not None)
+        if before is not None and start >= before:
+            return 0
+        scanned = 0
+        try:
+            async for message in channel.history(
+                limit=None, after=discord.Object(id=start), before=discord.Object(id=before) if before else None,
+                oldest_first=True
+            ):
+                await callback(message)
+                self.mark_seen(scanner, channel.id, message.id)
+                scanned += 1
+                if scanned % HistoryScanner.SAVE_EVERY == 0:
+                    await self.save()
+        finally:
+            await self.save()
+        logger.debug("Scanned {} messages in channel {} for {}".format(scanned, channel.id, scanner))
+        return scanned
+
+    async def save(self):
+        """
+        Saves every checkpoint that has moved since the last save, in one query
+        """
+        if not self.unsaved:
+            return
+        unsaved, self.unsaved = self.unsaved, {}
+        try:
+            async with self.client.acquire_data_connection() as conn:
+                await conn.execute(
+                    Statements.SAVE_HISTORY_CHECKPOINTS,
+                    [scanner for scanner, _ in unsaved], [channel_id for _, channel_id in unsaved],
+                    list(unsaved.values())
+                )
+        except asyncpg.PostgresError:
+            logger.error("Could not save history checkpoints", exc_info=True)
+            self.unsaved = {**unsaved, **self.unsaved}
@@ -0,0 +1,116 @@
+from time import monotonic
+from typing import Callable, Dict, List, Tuple, Mapping, Union
+
+import logging
+
+
+class DuplicateFilter(logging.Filter):
+    """
+    Lets the first of a run of identical records through and holds back any repeats for `window_seconds`. The next
+    copy that comes in after the window is let through with a `repeats` attribute saying how many were held back. If
+    no copy comes in, `take_repeats` hands back the last one that was held back once the window is over, so the end of
+    a burst isn't lost.
+
+    Records at `min_level` and above (ERROR by default) are never held back.
+    """
+    MAX_TRACKED = 1000
+
+    def __init__(self, window_seconds: float = 60, min_level=logging.ERROR, on_hold: Callable[[], None] = None):
+        super(DuplicateFilter, self).__init__()
+        self.window_seconds = window_seconds
+        self.min_level = min_level
+        # Called when a window holds back its first record, so whoever calls take_repeats knows to come back later
+        self.on_hold = on_hold
+        # (logger, level, message) -> [when the window started, how many were held back, the last one held back]
+        self.seen: Dict[Tuple[str, int, str], list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= self.min_level or self.window_seconds <= 0:
+            return True
+        now = monotonic()
+        key = (record.name, record.levelno, record.getMessage())
+        window = self.seen.get(key)
+        if window is not None and now - window[0] < self.window_seconds:
+            window[1] += 1
+            window[2] = record
+            if window[1] == 1 and self.on_hold is not None:
+                self.on_hold()
+            return False
+        if window is not None and window[1]:
+            record.repeats = window[1]
+        if len(self.seen) >= DuplicateFilter.MAX_TRACKED:
+            self.prune(now)
+        self.seen[key] = [now, 0, None]
+        return True
+
+    def seconds_until_repeats(self) -> Union[float, None]:
+        """
+        Gets how long until the first window that held something back is over, or None if nothing is held back
+        """
+        now = monotonic()
+        starts = [window[0] for window in list(self.seen.values()) if window[1]]
+        if not starts:
+            return None
+        return max(0.0, min(starts) + self.window_seconds - now)
+
+    def take_repeats(self, everything=False) -> List[logging.LogRecord]:
+        """
+        Ends every window that is over, or every window at all if `everything` is set, and gets the last record each
+        of them held back. Its `repeats` says how many more like it were held back.
+        """
+        now = monotonic()
+        records = []
+        for key, window in list(self.seen.items()):
+            if window[1] and (everything or now - window[0] >= self.window_seconds):
+                record = window[2]
+                record.repeats = window[1] - 1
+                records.append(record)
+                self.seen.pop(key, None)
+        return records
+
+    def prune(self, now):
+        self.seen = {key: window for key, window in self.seen.items() if now - window[0] < self.window_seconds}
+        if len(self.seen) >= DuplicateFilter.MAX_TRACKED:
+            self.seen = {}
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Only lets a fraction of the records from some loggers through. Rates are keyed by logger name, and apply to that
+    logger's children too: a rate of 0.1 for `houseofmisfits.weeping_willow.modules.venting` lets every tenth record
+    from the venting module through.
+
+    Records at `min_level` and above (WARNING by default) are never sampled.
+    """
+    def __init__(self, rates: Mapping[str, float] = None, min_level=logging.WARNING):
+        super(SamplingFilter, self).__init__()
+        self.min_level = min_level
+        self.rates: Dict[str, float] = {}
+        self.counts: Dict[str, float] = {}
+        self.set_rates(rates or {})
+
+    def set_rates(self, rates: Mapping[str, float]):
+        self.rates = dict(rates)
+        self.counts = {}
+
+    def rate_for(self, name: str) -> Tuple[str, float]:
+        while name:
+            if name in self.rates:
+                return name, self.rates[name]
+            name = name.rpartition('.')[0]
+        return '', 1.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if not self.rates or record.levelno >= self.min_level:
+            return True
+        name, rate = self.rate_for(record.name)
+        if rate >= 1:
+            return True
+        # Accumulate the rate and let a record through every time it adds up to a whole one, so the sample is spread
+        # evenly instead of being left to chance
+        count = self.counts.get(name, 0.0) + rate
+        if count >= 1:
+            self.counts[name] = count - 1
+            return True
+        self.counts[name] = count
+        return False
@@ -0,0 +1,98 @@
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from typing import Union
+
+import copy
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+
+
+class JsonLinesFormatter(logging.Formatter):
+    """
+    Formats every record as one line of JSON, so log files can be searched with grep or jq
+    """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            'time': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'module': record.module,
+            'line': record.lineno,
+            'thread': record.threadName,
+        }
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exception'] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class StructuredQueueHandler(QueueHandler):
+    """
+    Hands records over to the listener thread. The message is rendered here, since its arguments might change once
+    the record is out of the caller's hands, but the traceback is kept apart from the message.
+    """
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+def gzip_rotator(source: str, dest: str):
+    with open(source, 'rb') as source_file, gzip.open(dest, 'wb') as dest_file:
+        shutil.copyfileobj(source_file, dest_file)
+    os.remove(source)
+
+
+class FileLogSink:
+    """
+    Writes every log record to a rotating JSON lines file. Records are passed to a listener thread through a queue, so
+    the event loop never waits on disk.
+
+    It is set up from the environment: `LOG_FILE` is the path to write to (nothing is written if it isn't set),
+    `LOG_FILE_MAX_BYTES` is the size a file is rotated at, `LOG_FILE_BACKUPS` is how many rotated files are kept, and
+    `LOG_FILE_COMPRESS` gzips rotated files when it is set to `true`.
+    """
+    def __init__(self, path: str, max_bytes=10 * 1024 * 1024, backups=5, compress=False):
+        file_handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups, encoding='utf-8', delay=True)
+        file_handler.setFormatter(JsonLinesFormatter())
+        if compress:
+            file_handler.namer = lambda name: name + '.gz'
+            file_handler.rotator = gzip_rotator
+        self.file_handler = file_handler
+        self.queue = queue.Queue(-1)
+        self.handler = StructuredQueueHandler(self.queue)
+        self.listener = QueueListener(self.queue, file_handler)
+
+    @staticmethod
+    def from_env() -> Union['FileLogSink', None]:
+        path = os.getenv('LOG_FILE')
+        if not path:
+            return None
+        return FileLogSink(
+            path,
+            max_bytes=int(os.getenv('LOG_FILE_MAX_BYTES', 10 * 1024 * 1024)),
+            backups=int(os.getenv('LOG_FILE_BACKUPS', 5)),
+            compress=os.getenv('LOG_FILE_COMPRESS', '').lower() == 'true'
+        )
+
+    def start(self, attach_to: logging.Logger):
+        self.listener.start()
+        attach_to.addHandler(self.handler)
+
+    def stop(self, attached_to: logging.Logger):
+        """
+        Detaches the sink, then waits for the listener thread to write out everything that was queued
+        """
+        attached_to.removeHandler(self.handler)
+        self.listener.stop()
+        self.file_handler.close()
@@ -1,8 +1,20 @@
+import asyncio
+from collections import deque
+from datetime import datetime
+from heapq import merge
+from itertools import count
+from typing import Deque, Dict, List, Tuple, Union
+
 import logging
 import os
 
 import discord
 
+from houseofmisfits.weeping_willow.config_schema import default_config
+from houseofmisfits.weeping_willow.log_filters import DuplicateFilter, SamplingFilter
+
+logger = logging.getLogger(__name__)
+
 COLORS = {
     10: discord.Color.greyple(),
     20: discord.Color.dark_green(),
@@ -12,7 +24,37 @@ COLORS = {
 }
 
 
+class LogEntry:
+    __slots__ = ('sequence', 'levelno', 'text')
+
+    def __init__(self, sequence: int, levelno: int, text: str):
+        self.sequence = sequence
+        self.levelno = levelno
+        self.text = text
+
+    def __lt__(self, other: 'LogEntry'):
+        return self.sequence < other.sequence
+
+
 class LoggingEngine(logging.StreamHandler):
+    """
+    Ships log records to the logging channel. Records are queued by `emit` and sent in batches by a single worker, which
+    packs as many records as fit into each embed, so a burst of logging turns into a handful of messages instead of one
+    REST call per record.
+
+    The handler can be attached before `setup` has run. Records are queued from then on and sent once the logging
+    channel is known, so nothing logged while the bot is starting up is lost.
+
+    The queue holds at most `MAX_PENDING` records. When it is full, the oldest record of the lowest severity is dropped
+    to make room, and the drops are reported in the next batch. ERROR and CRITICAL records are never dropped, and any
+    batch that has one pings the tech role.
+
+    Before records are even queued, identical records are collapsed (`log_dedup_seconds`) and records from noisy
+    loggers can be sampled (`log_sampling`), so they cost neither formatting nor messages.
+
+    `emit` can be called from any thread, so the queue is only changed while holding the handler's lock, which
+    `logging.Handler.handle` already holds around `emit`.
+    """
     LOG_LEVELS = {
         'DEBUG': logging.DEBUG,
         'INFO': logging.INFO,
@@ -21,37 +63,223 @@ class LoggingEngine(logging.StreamHandler):
         'CRITICAL': logging.CRITICAL
     }
 
+    MAX_PENDING = 500
+    # How long to wait for more records after the first one comes in, and the least time between two sends
+    FLUSH_SECONDS = 2.0
+    # A batch is sent straight away once it has this many records
+    FLUSH_RECORDS = 50
+    # Embed descriptions are capped at 2048 characters
+    MAX_DESCRIPTION = 2048
+
     def __init__(self, client):
         logging.StreamHandler.__init__(self)
         self.client = client
         self.open = False
-        self.channel = None
+        self.closed = False
+        self.channel_id = None
+        self.channel: Union[discord.abc.Messageable, None] = None
+        self.pending: Dict[int, Deque[LogEntry]] = {}
+        self.pending_count = 0
+        self.sequence = count()
+        self.dropped: Dict[int, int] = {}
+        self.wakeup: Union[asyncio.Event, None] = None
+        self.worker: Union[asyncio.Task, None] = None
+        self.duplicate_filter = DuplicateFilter(on_hold=self.wake_for_repeats)
+        self.sampling_filter = SamplingFilter()
+        self.addFilter(self.duplicate_filter)
+        self.addFilter(self.sampling_filter)
+        self.subscriptions = []
 
     async def setup(self):
-        channel_id = await self.client.get_config('logging_channel')
+        channel_id, level_name, dedup_seconds, sampling = await self.client.get_configs(
+            ['logging_channel', 'log_level', 'log_dedup_seconds', 'log_sampling'], {'log_level': 'INFO'}
+        )
+        self.duplicate_filter.window_seconds = dedup_seconds
+        self.sampling_filter.set_rates(sampling)
+        if not self.subscriptions:
+            self.subscriptions = [
+                await self.client.data_connection.on_config_change('log_dedup_seconds', self.on_filter_change),
+                await self.client.data_connection.on_config_change('log_sampling', self.on_filter_change)
+            ]
+        self.channel = None
         if channel_id is not None:
-            self.channel = int(channel_id)
-            level_name = (await self.client.get_config('log_level', 'INFO')).upper()
-            self.setLevel(LoggingEngine.LOG_LEVELS[level_name])
-            self.open = True
+            self.channel = self.client.get_channel(channel_id)
+            if self.channel is None:
+                try:
+                    self.channel = await self.client.fetch_channel(channel_id)
+                except discord.DiscordException:
+                    logger.error("Could not find logging channel {}".format(channel_id), exc_info=True)
+        if self.channel is None:
+            self.close()
+            return
+        self.channel_id = channel_id
+        self.setLevel(LoggingEngine.LOG_LEVELS[level_name])
+        # Records queued before the level was known
+        with self.lock:
+            for levelno in [levelno for levelno in self.pending if levelno < self.level]:
+                self.pending_count -= len(self.pending.pop(levelno))
+        self.wakeup = asyncio.Event()
+        self.worker = self.client.loop.create_task(self.run_worker())
+        self.open = True
+        if self.pending_count:
+            self.wakeup.set()
+
+    async def on_filter_change(self, key, value):
+        if key == 'log_dedup_seconds':
+            self.duplicate_filter.window_seconds = value if value is not None else default_config(key)
+        else:
+            self.sampling_filter.set_rates(value or {})
 
     def close(self):
         self.channel = None
         self.open = False
+        self.closed = True
+        with self.lock:
+            self.pending = {}
+            self.pending_count = 0
+        if self.worker is not None:
+            self.worker.cancel()
+            self.worker = None
+
+    async def stop(self):
+        """
+        Sends whatever is still queued, then closes the engine
+        """
+        if self.open:
+            self.open = False
+            try:
+                self.queue_repeats(everything=True)
+                await self.flush_pending()
+            except Exception:
+                logger.error("Could not send the last log records", exc_info=True)
+        self.close()
 
     def emit(self, record):
-        if not self.open:
-            # Logging engine not started, drop record
+        if self.closed or record.name == __name__:
+            # The engine's own records only go to the console, since they are usually about not being able to send to
+            # the logging channel.
             return
-        message = self.format(record)
-        self.client.loop.create_task(self.push_log(record, message))
-
-    async def push_log(self, record: logging.LogRecord, message):
-        channel = self.client.get_channel(self.channel)
-        color = COLORS[record.levelno]
-        embed = discord.Embed()
-        embed.description = message
-        embed.set_footer(text=record.name)
-        embed.colour = color
-        plaintext = None if record.levelno < 40 else '<@&{}>'.format(os.getenv('BOT_TECH_ROLE'))
-        await channel.send(plaintext, embed=embed)
+        self.enqueue(LogEntry(next(self.sequence), record.levelno, self.describe(record)))
+        if self.open and (self.pending_count == 1 or self.pending_count == LoggingEngine.FLUSH_RECORDS):
+            self.client.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def describe(self, record: logging.LogRecord) -> str:
+        text = '`{} {} {}` {}'.format(
+            datetime.fromtimestamp(record.created).strftime('%H:%M:%S'), record.levelname, record.name,
+            self.format(record)
+        )
+        repeats = getattr(record, 'repeats', 0)
+        if repeats:
+            text += ' *(and {} more like this)*'.format(repeats)
+        return text[:LoggingEngine.MAX_DESCRIPTION]
+
+    def enqueue(self, entry: LogEntry):
+        if self.pending_count >= LoggingEngine.MAX_PENDING and entry.levelno < logging.ERROR:
+            lowest = min(level for level, entries in self.pending.items() if entries)
+            if lowest > entry.levelno or lowest >= logging.ERROR:
+                self.count_dropped(entry.levelno)
+                return
+            self.pending[lowest].popleft()
+            self.pending_count -= 1
+            self.count_dropped(lowest)
+        self.pending.setdefault(entry.levelno, deque()).append(entry)
+        self.pending_count += 1
+
+    def count_dropped(self, levelno):
+        self.dropped[levelno] = self.dropped.get(levelno, 0) + 1
+
+    def take_pending(self) -> List[LogEntry]:
+        """
+        Takes every queued record, oldest first
+        """
+        with self.lock:
+            entries = list(merge(*self.pending.values()))
+            self.pending = {}
+            self.pending_count = 0
+        return entries
+
+    def wake_for_repeats(self):
+        if self.open:
+            # The worker works out from the filter how long to wait before reporting the burst
+            self.client.loop.call_soon_threadsafe(self.wakeup.set)
+
+    def queue_repeats(self, everything=False):
+        """
+        Queues the last record of every burst the duplicate filter held back, once its window is over
+        """
+        for record in self.duplicate_filter.take_repeats(everything):
+            if record.levelno >= self.level:
+                with self.lock:
+                    self.enqueue(LogEntry(next(self.sequence), record.levelno, self.describe(record)))
+
+    async def run_worker(self):
+        while True:
+            try:
+                # Wake up for new records, or when the duplicate filter has a burst to report
+                await asyncio.wait_for(self.wakeup.wait(), self.duplicate_filter.seconds_until_repeats())
+            except asyncio.TimeoutError:
+                pass
+            self.queue_repeats()
+            if self.pending_count < LoggingEngine.FLUSH_RECORDS:
+                # Give the rest of a burst a moment to come in, so it goes out together
+                await asyncio.sleep(LoggingEngine.FLUSH_SECONDS)
+            self.wakeup.clear()
+            try:
+                await self.flush_pending()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.error("Could not send log records to the logging channel", exc_info=True)
+            # Leave room for the bot's own traffic between sends
+            await asyncio.sleep(LoggingEngine.FLUSH_SECONDS)
+            if self.pending_count:
+                # Errors put back after a failed send, or records that came in while sending. `emit` only wakes the
+                # worker when the queue goes from empty to one record, which can't happen while these are waiting.
+                self.wakeup.set()
+
+    async def flush_pending(self):
+        entries = self.take_pending()
+        if self.dropped:
+            notice = 'Log queue was full, dropped {}'.format(', '.join(
+                '{} {}'.format(dropped, logging.getLevelName(level)) for level, dropped in sorted(self.dropped.items())
+            ))
+            self.dropped = {}
+            entries.append(LogEntry(next(self.sequence), logging.WARNING, notice))
+        if not entries:
+            return
+        pages = self.pack(entries)
+        for i, (page, levelno) in enumerate(pages):
+            plaintext = None if levelno < logging.ERROR else '<@&{}>'.format(os.getenv('BOT_TECH_ROLE'))
+            description = '\n'.join(entry.text for entry in page)
+            try:
+                await self.channel.send(plaintext, embed=discord.Embed(description=description, colour=COLORS.get(levelno)))
+            except Exception:
+                # Errors have to get through, so put them back to be tried again with the next batch
+                with self.lock:
+                    for unsent, _ in pages[i:]:
+                        for entry in unsent:
+                            if entry.levelno >= logging.ERROR:
+                                self.pending.setdefault(entry.levelno, deque()).append(entry)
+                                self.pending_count += 1
+                raise
+
+    @staticmethod
+    def pack(entries: List[LogEntry]) -> List[Tuple[List[LogEntry], int]]:
+        """
+        Packs records into as few pages as possible, each small enough for an embed's description
+        :return: The records on each page, and the level of the most severe one
+        """
+        pages = []
+        page: List[LogEntry] = []
+        characters = 0
+        levelno = 0
+        for entry in entries:
+            if page and characters + len(entry.text) + 1 > LoggingEngine.MAX_DESCRIPTION:
+                pages.append((page, levelno))
+                page, characters, levelno = [], 0, 0
+            page.append(entry)
+            characters += len(entry.text) + 1
+            levelno = max(levelno, entry.levelno)
+        if page:
+            pages.append((page, levelno))
+        return pages
@@ -1,12 +1,34 @@
-__module_list__ = ['BotAdministrationModule', 'VentingModule', 'DMHandlerModule', 'MeditationModule', 'EventModule',
-                   'PrivateSupport']
-
-__all__ = ['Module'] + __module_list__
+from typing import List
 
 from .module import Module
-from .venting import VentingModule
-from .dm_handler import DMHandlerModule
-from .bot_administration import BotAdministrationModule
-from .meditation import MeditationModule
-from .event_module import EventModule
-from .private_support import PrivateSupport
+from .module_registry import ModuleSpec, builtin_module, entry_point_modules
+
+# Modules are only imported once they are needed, so that deployments that don't use a module never pay for importing
+# it (or whatever it depends on). The order here is the order triggers take precedence in.
+__module_specs__ = [
+    builtin_module('BotAdministrationModule', 'bot_administration'),
+    builtin_module('VentingModule', 'venting'),
+    builtin_module('DMHandlerModule', 'dm_handler'),
+    builtin_module('MeditationModule', 'meditation'),
+    builtin_module('EventModule', 'event_module'),
+    builtin_module('PrivateSupport', 'private_support'),
+    builtin_module('SupportModule', 'support', enabled_by_default=False),
+]
+
+__module_list__ = [spec.name for spec in __module_specs__]
+
+__all__ = ['Module', 'ModuleSpec', 'discover_modules'] + __module_list__
+
+
+def discover_modules() -> List[ModuleSpec]:
+    """
+    Gets the specs of the built in modules, followed by any modules other packages provide through entry points
+    """
+    return __module_specs__ + [spec for spec in entry_point_modules() if spec.name not in __module_list__]
+
+
+def __getattr__(name):
+    for spec in __module_specs__:
+        if spec.name == name:
+            return spec.load()
+    raise AttributeError("module {} has no attribute {}".format(__name__, name))
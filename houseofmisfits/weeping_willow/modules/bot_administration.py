@@ -4,8 +4,9 @@ import asyncpg
 import discord
 
 from houseofmisfits.weeping_willow.modules import Module
-from houseofmisfits.weeping_willow.triggers import Trigger, Command
+from houseofmisfits.weeping_willow.triggers import Trigger, Command, MessageContext
 from houseofmisfits.weeping_willow import LoggingEngine
+from houseofmisfits.weeping_willow.config_schema import ConfigValueError
 
 import os
 import logging
@@ -23,6 +24,8 @@ class BotAdministrationModule(Module):
         yield Command(self.client, 'getconfig', self.get_config).get_trigger()
         yield Command(self.client, 'clearconfig', self.clear_config).get_trigger()
         yield Command(self.client, 'loglevel', self.set_log_level).get_trigger()
+        yield Command(self.client, 'stats', self.show_stats).get_trigger()
+        yield Command(self.client, 'jobs', self.show_jobs).get_trigger()
 
     async def test_authorization(self, message):
         admin_users = await self.client.get_admin_users()
@@ -36,7 +39,7 @@ class BotAdministrationModule(Module):
             return False
         return True
 
-    async def restart(self, message: discord.Message):
+    async def restart(self, message: discord.Message, context: MessageContext):
         if not await self.test_authorization(message):
             return True
         await message.channel.send('Rebooting server')
@@ -47,11 +50,10 @@ class BotAdministrationModule(Module):
             await message.channel.send("Couldn't reboot :(")
             await self.client.change_presence(status=discord.Status.online)
 
-    async def set_config(self, message: discord.message):
+    async def set_config(self, message: discord.Message, context: MessageContext):
         if not await self.test_authorization(message):
             return True
-        args = message.content.split(' ')
-        args = [arg for arg in args if arg]
+        args = context.args
         if len(args) != 3:
             await message.channel.send(
                 embed=discord.Embed(
@@ -64,6 +66,14 @@ class BotAdministrationModule(Module):
         value = args[2]
         try:
             await self.client.set_config(config_key, value)
+        except ConfigValueError as e:
+            await message.channel.send(
+                embed=discord.Embed(
+                    description="Can't set `{}`: {}".format(config_key, e),
+                    color=discord.Color.red()
+                )
+            )
+            return True
         except asyncpg.SyntaxOrAccessError as e:
             await message.channel.send(
                 embed=discord.Embed(
@@ -74,11 +84,10 @@ class BotAdministrationModule(Module):
         await message.add_reaction('✅')
         return True
 
-    async def get_config(self, message: discord.message):
+    async def get_config(self, message: discord.Message, context: MessageContext):
         if not await self.test_authorization(message):
             return True
-        args = message.content.split(' ')
-        args = [arg for arg in args if arg]
+        args = context.args
         if len(args) != 2:
             await message.channel.send(
                 embed=discord.Embed(
@@ -88,7 +97,7 @@ class BotAdministrationModule(Module):
             )
         config_key = args[1]
         try:
-            val = await self.client.get_config(config_key)
+            val = self.client.data_connection.get_raw_config(config_key)
             await message.channel.send(
                 embed=discord.Embed(
                     title=config_key,
@@ -105,11 +114,10 @@ class BotAdministrationModule(Module):
             )
         return True
 
-    async def clear_config(self, message: discord.message):
+    async def clear_config(self, message: discord.Message, context: MessageContext):
         if not await self.test_authorization(message):
             return True
-        args = message.content.split(' ')
-        args = [arg for arg in args if arg]
+        args = context.args
         if len(args) != 2:
             await message.channel.send(
                 embed=discord.Embed(
@@ -130,10 +138,10 @@ class BotAdministrationModule(Module):
         await message.add_reaction('✅')
         return True
 
-    async def set_log_level(self, message: discord.Message):
+    async def set_log_level(self, message: discord.Message, context: MessageContext):
         if not await self.test_authorization(message):
             return True
-        args = [arg for arg in message.content.split(' ') if arg]
+        args = context.args
         if len(args) != 2 or args[1].upper() not in LoggingEngine.LOG_LEVELS:
             await message.channel.send(
                 embed=discord.Embed(
@@ -155,3 +163,112 @@ class BotAdministrationModule(Module):
         await message.add_reaction('✅')
         return True
 
+    async def show_stats(self, message: discord.Message, context: MessageContext):
+        if not await self.test_authorization(message):
+            return True
+        args = context.args
+        data_connection = self.client.data_connection
+        if len(args) > 1 and args[1] == 'reset':
+            self.client.stats.reset()
+            data_connection.stats.reset()
+            await message.add_reaction('✅')
+            return True
+        if len(args) > 1 and args[1] == 'db':
+            await message.channel.send(
+                embed=discord.Embed(
+                    title="Database stats",
+                    description=self.render_database_stats(data_connection.stats.snapshot(),
+                                                           data_connection.pool_usage()),
+                    color=discord.Color.orange()
+                )
+            )
+            return True
+        snapshot = self.client.stats.snapshot()
+        await message.channel.send(
+            embed=discord.Embed(
+                title="Message handling stats",
+                description=self.render_stats(snapshot, self.client.dispatcher.counters()),
+                color=discord.Color.orange()
+            )
+        )
+        return True
+
+    async def show_jobs(self, message: discord.Message, context: MessageContext):
+        if not await self.test_authorization(message):
+            return True
+        await message.channel.send(
+            embed=discord.Embed(
+                title="Scheduled jobs",
+                description=self.render_jobs(self.client.scheduler.list_jobs()),
+                color=discord.Color.orange()
+            )
+        )
+        return True
+
+    @staticmethod
+    def render_jobs(jobs):
+        """
+        Renders the scheduler's jobs, soonest first, as a fixed-width table that fits in an embed. Times are UTC.
+        """
+        def when(timestamp):
+            return timestamp.strftime('%Y-%m-%d %H:%M:%S') if timestamp is not None else 'never'
+
+        lines = []
+        for job in jobs:
+            running = ' (running)' if job.is_running else ''
+            lines.append('{:<40.40} {}{}'.format(job.name, job.describe_schedule(), running))
+            lines.append('  next {}  last {}  runs {} err {}'.format(
+                when(job.next_run), when(job.last_run), job.runs, job.errors
+            ))
+        return BotAdministrationModule.stats_table(lines or ['No jobs scheduled'])
+
+    @staticmethod
+    def render_stats(snapshot, dispatch_counters):
+        """
+        Renders a stats snapshot as a fixed-width table that fits in an embed
+        """
+        def short(label):
+            return label.replace('houseofmisfits.weeping_willow.modules.', '')
+
+        lines = [BotAdministrationModule.stats_header(),
+                 BotAdministrationModule.stats_row('all messages', snapshot['messages']), '', 'Handlers']
+        for label, stats in sorted(snapshot['handlers'].items(), key=lambda item: -item[1]['p99']):
+            lines.append(BotAdministrationModule.stats_row(short(label), stats))
+        lines += ['', 'Triggers']
+        for label, stats in sorted(snapshot['triggers'].items(), key=lambda item: -item[1]['p99']):
+            lines.append(BotAdministrationModule.stats_row(short(label), stats))
+        lines += ['', ' '.join('{}={}'.format(key, value) for key, value in dispatch_counters.items())]
+        return BotAdministrationModule.stats_table(lines)
+
+    @staticmethod
+    def render_database_stats(snapshot, pool_usage):
+        """
+        Renders the data connection's stats as a fixed-width table that fits in an embed
+        """
+        lines = [BotAdministrationModule.stats_header(),
+                 BotAdministrationModule.stats_row('pool acquire', snapshot['acquire']), '', 'Statements']
+        for label, stats in sorted(snapshot['statements'].items(), key=lambda item: -item[1]['p99']):
+            lines.append(BotAdministrationModule.stats_row(label, stats))
+        lines += ['', 'pool ' + ' '.join('{}={}'.format(key, value) for key, value in pool_usage.items())]
+        return BotAdministrationModule.stats_table(lines)
+
+    @staticmethod
+    def stats_header():
+        return '{:<34} {:>6} {:>4} {:>7} {:>7} {:>7}'.format('', 'n', 'err', 'p50 ms', 'p95 ms', 'p99 ms')
+
+    @staticmethod
+    def stats_row(label, stats):
+        return '{:<34.34} {:>6} {:>4} {:>7.1f} {:>7.1f} {:>7.1f}'.format(
+            label, stats['count'], stats['errors'],
+            stats['p50'] * 1000, stats['p95'] * 1000, stats['p99'] * 1000
+        )
+
+    @staticmethod
+    def stats_table(lines):
+        table = ''
+        for line in lines:
+            # Embed descriptions are capped at 2048 characters
+            if len(table) + len(line) + 8 > 2048:
+                break
+            table += line + '\n'
+        return '```\n{}```'.format(table)
@@ -0,0 +1,216 @@
+import asyncio
+import heapq
+import sys
+from datetime import datetime, timedelta
+from typing import Dict, List, Union
+
+import asyncpg
+import discord
+
+from houseofmisfits.weeping_willow.database import Statements
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ScheduledDeletion:
+    """
+    All that is kept about a message waiting to be deleted. Nothing from the message itself, like its content or
+    author, is held on to.
+    """
+    __slots__ = ('deadline', 'channel_id', 'message_id')
+
+    def __init__(self, channel_id: int, message_id: int, deadline: datetime):
+        self.channel_id = channel_id
+        self.message_id = message_id
+        self.deadline = deadline
+
+    def __lt__(self, other: 'ScheduledDeletion'):
+        return self.deadline < other.deadline
+
+
+class DeletionQueue:
+    """
+    Deletes messages once their time is up. Deadlines are kept in a min-heap, so the queue sleeps until exactly the
+    next deletion is due no matter how many are waiting, and every deadline is saved in the `scheduled_deletions`
+    table so that a restart picks up where it left off. Messages that come due together are bulk deleted.
+
+    Deadlines are naive UTC datetimes, the same as `discord.Message.created_at`.
+    """
+    # Discord's bulk delete takes at most 100 messages, none of them older than 14 days. The hour of margin keeps
+    # messages right at the limit out of bulk deletes.
+    BULK_DELETE_LIMIT = 100
+    BULK_DELETE_MAX_AGE = timedelta(days=14) - timedelta(hours=1)
+    # How long to wait before trying a channel's deletions again after something unexpected went wrong
+    RETRY_SECONDS = 30
+
+    def __init__(self, client):
+        from houseofmisfits.weeping_willow import WeepingWillowClient
+        self.client: WeepingWillowClient = client
+        self.heap: List[ScheduledDeletion] = []
+        self.deadlines: Dict[int, ScheduledDeletion] = {}
+        self.changed = asyncio.Event()
+        self.task: Union[asyncio.Task, None] = None
+
+    async def start(self):
+        """
+        Loads the saved deadlines and starts deleting messages as they come due
+        """
+        if self.task is not None:
+            return
+        try:
+            async with self.client.acquire_data_connection() as conn:
+                rows = await conn.fetch(Statements.SCHEDULED_DELETIONS)
+        except asyncpg.PostgresError:
+            logger.error("Could not load scheduled deletions", exc_info=True)
+            rows = []
+        for row in rows:
+            self.push(row['message_id'], row['channel_id'], row['delete_at'])
+        logger.info("Loaded {} scheduled message deletions ({:.1f} KiB)".format(len(rows), self.memory_usage() / 1024))
+        self.task = self.client.loop.create_task(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def __contains__(self, message_id):
+        return message_id in self.deadlines
+
+    def __len__(self):
+        return len(self.deadlines)
+
+    def memory_usage(self) -> int:
+        """
+        Gets roughly how many bytes the queue is using to keep track of its deletions
+        """
+        if not self.deadlines:
+            return sys.getsizeof(self.heap) + sys.getsizeof(self.deadlines)
+        # Every record is the same size, and so are the ints and datetimes in it
+        record = next(iter(self.deadlines.values()))
+        per_record = sys.getsizeof(record) + sys.getsizeof(record.channel_id) + sys.getsizeof(record.message_id) + \
+            sys.getsizeof(record.deadline)
+        return sys.getsizeof(self.heap) + sys.getsizeof(self.deadlines) + per_record * len(self.deadlines)
+
+    async def schedule(self, message: discord.Message, delete_at: datetime):
+        """
+        Schedules a message to be deleted. Only its id and its channel's id are kept. Scheduling a message that is
+        already scheduled does nothing.
+        """
+        if message.id in self.deadlines:
+            return
+        self.push(message.id, message.channel.id, delete_at)
+        try:
+            async with self.client.acquire_data_connection() as conn:
+                await conn.execute(Statements.SCHEDULE_DELETION, message.id, message.channel.id, delete_at)
+        except asyncpg.PostgresError:
+            logger.error("Could not save the deletion of message {}. It will still be deleted unless the bot "
+                         "restarts first.".format(message.id), exc_info=True)
+
+    def push(self, message_id, channel_id, delete_at: datetime):
+        deletion = ScheduledDeletion(channel_id, message_id, delete_at)
+        self.deadlines[message_id] = deletion
+        heapq.heappush(self.heap, deletion)
+        if self.heap[0] is deletion:
+            # The next deletion moved up, so the queue needs to wake up sooner
+            self.changed.set()
+
+    async def run(self):
+        while True:
+            if not self.heap:
+                await self.changed.wait()
+                self.changed.clear()
+                continue
+            delay = (self.heap[0].deadline - datetime.utcnow()).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.changed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                self.changed.clear()
+                continue
+            # noinspection PyBroadException
+            try:
+                await self.delete_due()
+            except Exception:
+                # This task is the only thing deleting vents, so it must not die
+                logger.error("Unexpected error while deleting scheduled messages", exc_info=True)
+                await asyncio.sleep(DeletionQueue.RETRY_SECONDS)
+
+    async def delete_due(self):
+        """
+        Deletes every message that is due, grouped by channel so that they can be bulk deleted
+        """
+        now = datetime.utcnow()
+        due: Dict[int, List[int]] = {}
+        while self.heap and self.heap[0].deadline <= now:
+            deletion = heapq.heappop(self.heap)
+            del self.deadlines[deletion.message_id]
+            due.setdefault(deletion.channel_id, []).append(deletion.message_id)
+        for channel_id, message_ids in due.items():
+            # noinspection PyBroadException
+            try:
+                await self.delete_from_channel(channel_id, message_ids)
+                await self.unschedule(message_ids)
+            except Exception:
+                logger.error("Could not delete {} messages in channel {}, trying again in {}s".format(
+                    len(message_ids), channel_id, DeletionQueue.RETRY_SECONDS
+                ), exc_info=True)
+                retry_at = now + timedelta(seconds=DeletionQueue.RETRY_SECONDS)
+                for message_id in message_ids:
+                    self.push(message_id, channel_id, retry_at)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("{} deletions still scheduled ({:.1f} KiB)".format(len(self), self.memory_usage() / 1024))
+
+    async def delete_from_channel(self, channel_id, message_ids: List[int]):
+        """
+        Bulk deletes messages from a channel, 100 at a time. Messages too old to be bulk deleted, and any batch the bulk
+        delete fails for, are deleted one at a time instead.
+        """
+        oldest_bulk = datetime.utcnow() - DeletionQueue.BULK_DELETE_MAX_AGE
+        bulk = [message_id for message_id in message_ids if discord.utils.snowflake_time(message_id) > oldest_bulk]
+        single = [message_id for message_id in message_ids if discord.utils.snowflake_time(message_id) <= oldest_bulk]
+        deleted = 0
+        for i in range(0, len(bulk), DeletionQueue.BULK_DELETE_LIMIT):
+            batch = bulk[i:i + DeletionQueue.BULK_DELETE_LIMIT]
+            if len(batch) == 1:
+                single += batch
+                continue
+            try:
+                await self.client.http.delete_messages(channel_id, batch)
+                deleted += len(batch)
+            except discord.HTTPException as e:
+                logger.warning("Could not bulk delete {} messages in channel {} ({}), deleting them one at a time"
+                               .format(len(batch), channel_id, e))
+                single += batch
+        failed = 0
+        for message_id in single:
+            if await self.delete_one(channel_id, message_id):
+                deleted += 1
+            else:
+                failed += 1
+        logger.debug("Deleted {} messages in channel {}, {} one at a time, {} failed".format(
+            deleted, channel_id, len(single) - failed, failed
+        ))
+
+    async def delete_one(self, channel_id, message_id) -> bool:
+        try:
+            await self.client.http.delete_message(channel_id, message_id)
+        except discord.NotFound:
+            pass
+        except discord.DiscordException as e:
+            logger.warning("Unable to delete message {} in channel {}. Got exception {}".format(
+                message_id, channel_id, str(e)
+            ))
+            return False
+        return True
+
+    async def unschedule(self, message_ids: List[int]):
+        try:
+            async with self.client.acquire_data_connection() as conn:
+                await conn.execute(Statements.UNSCHEDULE_DELETIONS, message_ids)
+        except asyncpg.PostgresError:
+            logger.error("Could not remove {} deleted messages from the scheduled deletions table".format(
+                len(message_ids)
+            ), exc_info=True)
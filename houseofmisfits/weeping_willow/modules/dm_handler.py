@@ -4,7 +4,7 @@ from typing import List
 import discord
 
 from houseofmisfits.weeping_willow.modules import Module
-from houseofmisfits.weeping_willow.triggers import Trigger
+from houseofmisfits.weeping_willow.triggers import Trigger, MessageContext
 from houseofmisfits.weeping_willow.triggers.dm_trigger import DMTrigger
 
 import logging
@@ -38,7 +38,7 @@ class DMHandlerModule(Module):
         self.dm_channels = dm_channels
         logger.info(str(len(self.dm_channels)) + " users will be notified if the bot is DMed.")
 
-    async def handle_dm(self, message) -> bool:
+    async def handle_dm(self, message, context: MessageContext) -> bool:
         loop = asyncio.get_running_loop()
         loop.create_task(
             message.channel.send("Hello, there! Please do not DM this bot. If you have any questions about House of "
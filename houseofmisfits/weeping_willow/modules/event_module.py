@@ -1,11 +1,14 @@
 import asyncio
 import pytz
-from typing import AsyncIterable
+from typing import AsyncIterable, Dict, List, Set, Tuple, Union
 
+import asyncpg
 import discord
 
 from houseofmisfits.weeping_willow.modules import Module
-from houseofmisfits.weeping_willow.triggers import Trigger, ChannelTrigger, Command
+from houseofmisfits.weeping_willow.modules.role_reconciler import RoleReconciler
+from houseofmisfits.weeping_willow.triggers import Trigger, ChannelTrigger, Command, MessageContext
+from houseofmisfits.weeping_willow.database import Statements
 
 from datetime import date, time, datetime, timedelta
 import logging
@@ -24,28 +27,59 @@ weekdays = {
 
 
 class EventModule(Module):
+    SCANNER = 'event'
+    RESET_TIME = time(2)  # 2:00 AM, server time
+    SCAN_SECONDS = 2 * 60 * 60
+    SCAN_JITTER_SECONDS = 60
+    # New participants are written in batches, whichever of these comes first
+    FLUSH_SECONDS = 5
+    FLUSH_ROWS = 50
+
     def __init__(self, client):
         from houseofmisfits.weeping_willow import WeepingWillowClient
         self.client: WeepingWillowClient = client
         self.trigger = None
-        self.reset_ts = None
-        self.scan_ts = datetime.now()
-        self.is_open = True
+        self.jobs_scheduled = False
         self.command = Command(self.client, 'events', self.events_command)
+        self.command_trigger = self.command.get_trigger()
         self.backdated = False
+        self.role_sync = RoleReconciler(client, 'participant')
+        # Everyone who has participated today, so that only someone's first message of the day costs anything
+        self.participants: Set[int] = set()
+        self.participants_date: Union[date, None] = None
+        # (participation date, member id, message id) rows that haven't been written yet
+        self.pending: List[Tuple[date, int, int]] = []
+        self.flush_handle: Union[asyncio.TimerHandle, None] = None
+        # Event channel ids by day of week, loaded once and kept up to date by set_event
+        self.schedule: Union[Dict[int, Union[int, None]], None] = None
+        # The first and last snowflake of today's participation window, worked out whenever the trigger is created
+        self.window: Tuple[int, int] = (0, 0)
+        self.config_subscription = None
+        # Subcommands that wait for a confirmation or go through the whole role run as their own tasks
+        self.command_tasks: Set[asyncio.Task] = set()
 
     async def get_triggers(self) -> AsyncIterable[Trigger]:
-        await self.reset_trigger()
+        self.trigger = await self.create_trigger()
         yield self.trigger
-        yield self.command.get_trigger()
-        asyncio.get_running_loop().create_task(self.loop_daily())
-        asyncio.get_running_loop().create_task(self.scan_for_messages())
+        yield self.command_trigger
+        if not self.jobs_scheduled:
+            # First time the module is registered, rather than a reload. Going through the role's members can take a
+            # while, and doesn't need to hold up the rest of start-up.
+            self.jobs_scheduled = True
+            self.config_subscription = await self.client.data_connection.on_config_change(
+                'event_*', self.reset_module
+            )
+            asyncio.get_running_loop().create_task(self.reset_participant_role())
+            self.client.scheduler.daily('events: daily reset', EventModule.RESET_TIME, self.reset_trigger)
+            self.client.scheduler.every(
+                'events: scan for missed participants', EventModule.SCAN_SECONDS, self.scan_for_messages,
+                jitter=EventModule.SCAN_JITTER_SECONDS, run_now=True
+            )
 
-    async def events_command(self, message):
+    async def events_command(self, message, context: MessageContext):
         if not await self.test_authorization(message):
             return True
-        args = message.content.split(' ')
-        args = [arg for arg in args if arg]
+        args = context.args
         if len(args) == 1:
             await message.channel.send(
                 embed=discord.Embed(
@@ -60,15 +94,15 @@ class EventModule(Module):
                 )
             )
         elif args[1] == 'set':
-            await self.set_command(args, message)
+            self.start_command(self.set_command(args, message))
         elif args[1] == 'clear':
-            await self.clear_command(args, message)
+            self.start_command(self.clear_command(args, message))
         elif args[1] == 'role':
             await self.role_command(args, message)
         elif args[1] == 'getparticipants':
-            await self.get_participants_command(args, message)
+            self.start_command(self.get_participants_command(args, message))
         elif args[1] == 'resetparticipants':
-            await self.reset_participants_command(args, message)
+            self.start_command(self.reset_participants_command(args, message))
         else:
             await self.send_error(
                 message.channel,
@@ -76,6 +110,23 @@ class EventModule(Module):
             )
         return True
 
+    def start_command(self, command):
+        """
+        Runs a slow subcommand as its own task, so it doesn't keep the dispatcher from handling the channel's next
+        message
+        """
+        task = asyncio.get_running_loop().create_task(self.run_command(command))
+        self.command_tasks.add(task)
+        task.add_done_callback(self.command_tasks.discard)
+
+    @staticmethod
+    async def run_command(command):
+        # noinspection PyBroadException
+        try:
+            await command
+        except Exception:
+            logger.error("Unhandled exception in events command", exc_info=True)
+
     async def set_command(self, args, message):
         if len(args) < 4:
             await self.send_error(
@@ -144,14 +195,15 @@ class EventModule(Module):
         return str(reaction.emoji) == '✅'
 
     async def set_event(self, day_of_week, channel_id):
-        async with self.client.data_connection.pool.acquire() as conn:
+        async with self.client.acquire_data_connection() as conn:
             await conn.execute(
                 "UPDATE event_channels SET channel_id = $2 WHERE day_of_week = $1",
                 day_of_week, channel_id
             )
+        if self.schedule is not None:
+            self.schedule[day_of_week] = channel_id
         if date.today().weekday() == day_of_week:
             await self.reset_trigger()
-            self.client.add_trigger(self.trigger)
 
     async def role_command(self, args, message):
         if len(args) < 3:
@@ -163,7 +215,7 @@ class EventModule(Module):
             return
         try:
             role = self.get_role_id(args[2])
-            await self.client.set_config('participant_role', str(role))
+            await self.client.set_config('participant_role', role)
             await message.add_reaction('✅')
         except ValueError:
             await self.send_error(
@@ -206,20 +258,33 @@ class EventModule(Module):
 
     async def set_participants_role_to_day(self, event_date):
         self.backdated = True
-        await self.clear_participant_role()
-        participants = await self.get_participants_for_day(event_date)
-        for user_id in participants:
-            participant = self.client.get_user(user_id)
-            await self.add_participant_role(participant)
+        await self.sync_participant_role(set(await self.get_participants_for_day(event_date)))
 
     async def reset_participant_role(self):
-        await self.clear_participant_role()
-        todays_participants = await self.get_participants_for_day(date.today())
-        for user_id in todays_participants:
-            participant = self.client.get_user(user_id)
-            await self.add_participant_role(participant)
+        today = date.today()
+        participants = set(await self.get_participants_for_day(today))
+        # Keep anyone who participated while the query was running, or whose row hasn't been written yet
+        participants |= self.todays_participants()
+        self.participants, self.participants_date = participants, today
+        await self.sync_participant_role(participants)
         self.backdated = False
 
+    async def sync_participant_role(self, participants: Set[int]):
+        """
+        Gives the participant role to exactly `participants`
+        """
+        participant_role = await self.get_participant_role()
+        if participant_role is None:
+            logger.warning("Participant role is not set, not syncing it")
+            return
+        await self.role_sync.reconcile(participant_role, participants)
+
+    def todays_participants(self) -> Set[int]:
+        today = date.today()
+        if self.participants_date != today:
+            self.participants, self.participants_date = set(), today
+        return self.participants
+
     async def test_authorization(self, message):
         admin_users = await self.client.get_admin_users()
         if message.author not in admin_users:
@@ -259,123 +324,133 @@ class EventModule(Module):
         raise ValueError()
 
     async def reset_trigger(self):
-        if self.trigger is not None:
-            logger.debug("Removing old channel trigger")
-            self.client.triggers.remove(self.trigger)
-            self.trigger = None
-        self.trigger = await self.create_trigger()
+        logger.debug("Reloading event channel trigger")
+        await self.client.reload_module(self)
         await self.reset_participant_role()
-        self.schedule_next_day()
+
+    async def reset_module(self, key, value):
+        await self.client.reload_module(self)
 
     async def create_trigger(self):
-        async with self.client.data_connection.pool.acquire() as conn:
-            participant_channel = await conn.fetchrow(
-                "SELECT channel_id FROM event_channels WHERE day_of_week = $1", date.today().weekday())
-        if participant_channel['channel_id'] is None:
+        today = date.today()
+        window_start, window_end = await self.event_window(today)
+        self.window = (discord.utils.time_snowflake(window_start), discord.utils.time_snowflake(window_end, high=True))
+        channel_id = await self.get_event_channel(today.weekday())
+        if channel_id is None:
             logger.info("No event set for today, not adding a trigger.")
             return None
-        logger.info("Setting event channel to channel {}".format(participant_channel['channel_id']))
-        trigger = ChannelTrigger(str(participant_channel['channel_id']), self.process_participant)
-        self.client.add_trigger(trigger)
-        return trigger
+        logger.info("Setting event channel to channel {}".format(channel_id))
+        return ChannelTrigger(str(channel_id), self.process_participant)
 
-    async def clear_participant_role(self):
-        logger.debug("Clearing participant role")
-        participant_role = await self.get_participant_role()
-        for user in participant_role.members:
-            await user.remove_roles(participant_role)
-
-    def schedule_next_day(self):
-        if datetime.now().time() > time(2, 0, 0):
-            today = date.today() + timedelta(days=1)
-        else:
-            today = date.today()
-        reset_time = time(2, 0, 0)  # 2:00 AM
-        self.reset_ts = datetime.combine(today, reset_time)
-        logger.info("Will reset event stuff at {}".format(self.reset_ts))
-
-    async def process_participant(self, message):
+    async def process_participant(self, message, context: MessageContext = None):
         if str(message.channel.id) != self.trigger.trigger_value:
             return False
-        if EventModule.get_est_time(message).time() < time(6) or EventModule.get_est_time(message).time() > time(18):
+        if not self.window[0] <= message.id <= self.window[1]:
             return False
         if message.author.bot:
             return False
-        self.client.loop.create_task(self.update_participant_database(message))
+        participants = self.todays_participants()
+        if message.author.id in participants:
+            return True
+        participants.add(message.author.id)
+        self.queue_participant(message)
         if not self.backdated:
             await self.add_participant_role(message.author)
         return True
 
-    async def update_participant_database(self, message):
-        async with self.client.data_connection.pool.acquire() as conn:
-            result = await conn.fetchrow(
-                'SELECT message_id FROM event_participants WHERE participation_dt = $1 AND member_id = $2',
-                date.today(), message.author.id
-            )
-            if result is not None:
-                return
-            await conn.execute(
-                "INSERT INTO event_participants VALUES ($1, $2, $3);",
-                date.today(), message.author.id, message.id
+    def queue_participant(self, message):
+        self.pending.append((self.participants_date, message.author.id, message.id))
+        if len(self.pending) >= EventModule.FLUSH_ROWS:
+            self.client.loop.create_task(self.flush_participants())
+        elif self.flush_handle is None:
+            self.flush_handle = self.client.loop.call_later(
+                EventModule.FLUSH_SECONDS, lambda: self.client.loop.create_task(self.flush_participants())
             )
 
+    async def flush_participants(self):
+        """
+        Writes every queued participant in one query. Rows that fail to write stay queued for the next flush.
+        """
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        if not self.pending:
+            return
+        pending, self.pending = self.pending, []
+        try:
+            async with self.client.acquire_data_connection() as conn:
+                await conn.execute(
+                    Statements.ADD_EVENT_PARTICIPANTS,
+                    [row[0] for row in pending], [row[1] for row in pending], [row[2] for row in pending]
+                )
+        except asyncpg.PostgresError:
+            logger.error("Could not save {} event participants".format(len(pending)), exc_info=True)
+            self.pending = pending + self.pending
+            return
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Saved {} event participants".format(len(pending)))
+
+    async def close(self):
+        for task in list(self.command_tasks):
+            task.cancel()
+        await self.flush_participants()
+
     async def add_participant_role(self, user):
         member = self.client.guild.get_member(user.id)
         if member is None:
             logger.debug("User {} is not a valid member - skipping".format(user.id))
             return
-        logger.debug("Giving user {} the participant role".format(member.id))
-        await member.add_roles(await self.get_participant_role())
+        participant_role = await self.get_participant_role()
+        if participant_role in member.roles:
+            return
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Giving user {} the participant role".format(member.id))
+        await member.add_roles(participant_role)
 
     async def get_participant_role(self):
         role_id = await self.client.get_config('participant_role')
-        logger.debug("Participant role ID: " + role_id)
-        return self.client.guild.get_role(int(role_id))
-
-    async def loop_daily(self):
-        while self.is_open:
-            if datetime.now() > self.reset_ts:
-                await self.reset_trigger()
-                await self.clear_participant_role()
-                self.client.add_trigger(self.trigger)
-                self.schedule_next_day()
-            await asyncio.sleep(10)
+        return self.client.guild.get_role(role_id)
 
     async def scan_for_messages(self):
-        while self.is_open:
-            if datetime.now() > self.scan_ts and self.trigger:
-                logger.info("Scanning for missed event participants")
-                participant_users = await self.get_participants_for_day(date.today())
-                event_channel = await self.get_event_channel(date.today().weekday())
-                channel: discord.TextChannel = self.client.get_channel(event_channel)
-                async for message in channel.history(limit=200):
-                    if EventModule.get_est_time(message).date() != date.today():
-                        continue
-                    if message.author.id not in participant_users:
-                        logger.debug("Found message {} for user not in participants list, adding participant".format(
-                            message.id
-                        ))
-                        await self.process_participant(message)
-                self.scan_ts = datetime.now() + timedelta(hours=2)
-            await asyncio.sleep(5)
+        if not self.trigger:
+            return
+        logger.info("Scanning for missed event participants")
+        event_channel = await self.get_event_channel(date.today().weekday())
+        channel: discord.TextChannel = self.client.get_channel(event_channel)
+
+        await self.client.history_scanner.scan(
+            EventModule.SCANNER, channel, self.process_missed,
+            after=self.window[0], before=self.window[1]
+        )
+
+    async def process_missed(self, message):
+        if message.author.id not in self.todays_participants():
+            logger.debug("Found message {} for user not in participants list, adding participant".format(message.id))
+            await self.process_participant(message)
 
     async def get_participants_for_day(self, event_date):
-        async with self.client.data_connection.pool.acquire() as conn:
-            results = await conn.fetch(
-                "SELECT member_id FROM event_participants WHERE participation_dt = $1", event_date)
+        async with self.client.acquire_data_connection() as conn:
+            results = await conn.fetch(Statements.EVENT_PARTICIPANTS, event_date)
             return [int(result['member_id']) for result in results] if results is not None else []
 
-    async def get_event_channel(self, weekday):
-        async with self.client.data_connection.pool.acquire() as conn:
-            result = await conn.fetchrow('SELECT channel_id FROM event_channels WHERE day_of_week = $1', weekday)
-            return int(result['channel_id'])
-
-    @staticmethod
-    def get_est_time(message: discord.Message) -> datetime:
-        utc = pytz.utc
-        est = pytz.timezone('America/New_York')
-        ts = utc.localize(message.created_at)
-        return ts.astimezone(est)
+    async def get_event_channel(self, weekday) -> Union[int, None]:
+        if self.schedule is None:
+            async with self.client.acquire_data_connection() as conn:
+                results = await conn.fetch(Statements.EVENT_SCHEDULE)
+            self.schedule = {result['day_of_week']: result['channel_id'] for result in results}
+        return self.schedule.get(weekday)
+
+    async def event_window(self, event_date: date) -> Tuple[datetime, datetime]:
+        """
+        Gets when messages count towards the event on a given day, as naive UTC datetimes. The window is 6 AM to 6 PM
+        Eastern unless `event_timezone`, `event_window_start` or `event_window_end` say otherwise.
+        """
+        timezone, start_time, end_time = await self.client.get_configs(
+            ['event_timezone', 'event_window_start', 'event_window_end']
+        )
+        start = timezone.localize(datetime.combine(event_date, start_time))
+        end = timezone.localize(datetime.combine(event_date, end_time))
+        return start.astimezone(pytz.utc).replace(tzinfo=None), end.astimezone(pytz.utc).replace(tzinfo=None)
 
     @staticmethod
     async def send_error(channel, message):
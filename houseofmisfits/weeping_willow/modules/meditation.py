@@ -4,7 +4,7 @@ from typing import AsyncIterable
 import discord
 
 from houseofmisfits.weeping_willow.modules import Module
-from houseofmisfits.weeping_willow.triggers import Trigger, Command
+from houseofmisfits.weeping_willow.triggers import Trigger, Command, MessageContext
 
 import logging
 
@@ -17,6 +17,14 @@ class MeditationModule(Module):
     def __init__(self, client):
         self.client = client
         self.vc = None
+
+    @staticmethod
+    def load_opus():
+        """
+        Loads the voice codec the first time it is needed, so that bots that never meditate never load it
+        """
+        if discord.opus.is_loaded():
+            return
         try:
             discord.opus.load_opus("libopus.so.0")
         except OSError:
@@ -26,7 +34,7 @@ class MeditationModule(Module):
         yield Command(self.client, 'meditate', self.meditate).get_trigger()
         yield Command(self.client, 'stop', self.stop_meditation).get_trigger()
 
-    async def meditate(self, message):
+    async def meditate(self, message, context: MessageContext):
         author = message.author
         if not author.voice:
             await message.channel.send('You need to be in a voice channel to do that!')
@@ -34,21 +42,29 @@ class MeditationModule(Module):
         elif self.vc is not None:
             await message.channel.send("I'm already meditating.")
             return False
+        self.load_opus()
         self.vc = await author.voice.channel.connect()
-        self.vc.play(discord.FFmpegPCMAudio(MEDITATION_SOURCE))
-        asyncio.get_event_loop().create_task(self.wait_to_stop())
+        vc = self.vc
+        loop = asyncio.get_running_loop()
+        # The callback runs on the audio player's thread once the recording ends or is stopped
+        vc.play(
+            discord.FFmpegPCMAudio(MEDITATION_SOURCE),
+            after=lambda error: asyncio.run_coroutine_threadsafe(self.finish_meditation(vc, error), loop)
+        )
         return True
 
-    async def wait_to_stop(self):
-        while self.vc and self.vc.is_playing:
-            await asyncio.sleep(1)
-        self.vc.stop()
-        await self.vc.disconnect()
+    async def finish_meditation(self, vc, error=None):
+        if error is not None:
+            logger.error("Meditation playback failed: {}".format(error))
+        if self.vc is not vc:
+            # Already stopped with the stop command
+            return
+        await vc.disconnect()
         self.vc = None
 
-    async def stop_meditation(self, message):
+    async def stop_meditation(self, message, context: MessageContext):
         if not self.vc:
             return False
-        self.vc.stop()
-        await self.vc.disconnect()
-        self.vc = None
+        vc, self.vc = self.vc, None
+        vc.stop()
+        await vc.disconnect()
@@ -1,8 +1,19 @@
-from typing import AsyncIterable
+from typing import AsyncIterable, Tuple
 
 from houseofmisfits.weeping_willow.triggers import Trigger
 
 
 class Module:
+    # Class names of the modules that have to give their triggers before this one does. Modules without dependencies
+    # between them start up at the same time.
+    depends_on: Tuple[str, ...] = ()
+
     async def get_triggers(self) -> AsyncIterable[Trigger]:
         raise NotImplementedError()
+
+    async def close(self):
+        """
+        Runs when the bot shuts down, while the data connection is still open. Modules that hold on to unsaved work
+        save it here.
+        """
+        pass
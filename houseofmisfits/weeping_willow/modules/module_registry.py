@@ -0,0 +1,74 @@
+import importlib
+from importlib import metadata
+from time import perf_counter
+from typing import List, Union, AbstractSet
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+ENTRY_POINT_GROUP = 'weeping_willow.modules'
+
+
+class ModuleSpec:
+    """
+    Says where a module class lives, without importing it. The import only happens when `load` is called, which is only
+    done for modules that are enabled.
+    """
+    def __init__(self, name: str, import_path: str, attribute: Union[str, None] = None, enabled_by_default=True):
+        self.name = name
+        self.import_path = import_path
+        self.attribute = attribute or name
+        self.enabled_by_default = enabled_by_default
+        self.import_seconds: Union[float, None] = None
+
+    def is_enabled(self, enabled: Union[AbstractSet[str], None], disabled: Union[AbstractSet[str], None]) -> bool:
+        """
+        Checks the `modules_enabled` and `modules_disabled` config. Naming a module in `modules_enabled` always turns
+        it on, otherwise it is on if it is on by default and not named in `modules_disabled`. A list that isn't set
+        counts as empty.
+        """
+        enabled = enabled or frozenset()
+        disabled = disabled or frozenset()
+        if self.name in enabled:
+            return True
+        return self.enabled_by_default and self.name not in disabled
+
+    def load(self):
+        """
+        Imports the module class. How long the import took is kept in `import_seconds`.
+        """
+        start = perf_counter()
+        module_class = getattr(importlib.import_module(self.import_path), self.attribute)
+        if self.import_seconds is None:
+            self.import_seconds = perf_counter() - start
+        return module_class
+
+    def __str__(self):
+        return '{} ({}:{})'.format(self.name, self.import_path, self.attribute)
+
+
+def builtin_module(name: str, submodule: str, enabled_by_default=True) -> ModuleSpec:
+    return ModuleSpec(name, 'houseofmisfits.weeping_willow.modules.' + submodule,
+                      enabled_by_default=enabled_by_default)
+
+
+def entry_point_modules() -> List[ModuleSpec]:
+    """
+    Finds modules that other installed packages provide through the `weeping_willow.modules` entry point group, like:
+
+        entry_points={'weeping_willow.modules': ['MyModule = my_package.my_module:MyModule']}
+
+    Modules from other packages are off until they are named in `modules_enabled`.
+    """
+    entry_points = metadata.entry_points()
+    if hasattr(entry_points, 'select'):
+        group = entry_points.select(group=ENTRY_POINT_GROUP)
+    else:
+        group = entry_points.get(ENTRY_POINT_GROUP, [])
+    specs = []
+    for entry_point in group:
+        import_path, _, attribute = entry_point.value.partition(':')
+        specs.append(ModuleSpec(entry_point.name, import_path.strip(), attribute.strip() or None,
+                                enabled_by_default=False))
+    return specs
@@ -2,14 +2,13 @@ import os
 from typing import AsyncIterable
 
 from houseofmisfits.weeping_willow.modules import Module
-from houseofmisfits.weeping_willow.triggers import Trigger, Command
+from houseofmisfits.weeping_willow.triggers import Trigger, Command, MessageContext
 
 import discord
 import logging
 import re
 
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 
 class PrivateSupport(Module):
@@ -20,15 +19,16 @@ class PrivateSupport(Module):
     async def get_triggers(self) -> AsyncIterable[Trigger]:
         yield Command(self.client, 'private', self.handle_command).get_trigger()
 
-    async def handle_command(self, message):
+    async def handle_command(self, message, context: MessageContext):
         """
         Handles whenever someone types a `.private` command
         :param message: The message the command was typed in
+        :param context: The parsed message
         :return: Always True
         """
-        if not await self.test_authorization(message):
+        if not await self.test_authorization(message, context):
             return True
-        args = [arg for arg in message.content.split(' ') if arg]
+        args = context.args
         if len(args) == 1:
             await message.channel.send(
                 embed=discord.Embed(
@@ -53,16 +53,15 @@ class PrivateSupport(Module):
             )
         return True
 
-    async def test_authorization(self, message: discord.Message):
+    async def test_authorization(self, message: discord.Message, context: MessageContext):
         support_role = await self.client.get_config('support_role_id')
-        for role in message.author.roles:
-            if str(role.id) == support_role:
-                if not message.channel.name.startswith('private-support'):
-                    logger.info("`.private` issued in channel that is not `private-support` {}".format(
-                        message.jump_url)
-                    )
-                    return False
-                return True
+        if support_role in context.author_roles:
+            if not message.channel.name.startswith('private-support'):
+                logger.info("`.private` issued in channel that is not `private-support` {}".format(
+                    message.jump_url)
+                )
+                return False
+            return True
         logger.info("`.private` issued by non-support member. {}".format(message.jump_url))
         return False
 
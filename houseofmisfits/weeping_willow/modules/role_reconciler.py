@@ -0,0 +1,101 @@
+import asyncio
+from time import perf_counter
+from typing import Dict, Set, Union
+
+import discord
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class RoleReconciler:
+    """
+    Makes a role's members match a set of user ids. Only the difference is applied: members who have the role and
+    should keep it, and users who shouldn't have it and don't, cost nothing. The adds and removes run a few at a time
+    through the Discord client, which waits out rate limits on its own.
+
+    Starting a new reconcile cancels the one in progress, since the new target replaces the old one. Nothing has to be
+    saved to pick up after an interruption: the next reconcile works out whatever is still left from the role itself.
+    """
+    CONCURRENCY = 4
+    # How often progress is logged, as a share of the changes to make
+    PROGRESS_STEP = 0.25
+
+    def __init__(self, client, name: str):
+        from houseofmisfits.weeping_willow import WeepingWillowClient
+        self.client: WeepingWillowClient = client
+        self.name = name
+        self.task: Union[asyncio.Task, None] = None
+        self.next_report = RoleReconciler.PROGRESS_STEP
+        self.progress: Dict[str, int] = {'total': 0, 'added': 0, 'removed': 0, 'failed': 0}
+
+    async def reconcile(self, role: discord.Role, target: Set[int]) -> Dict[str, int]:
+        """
+        Gives `role` to the users in `target` and takes it away from everyone else
+        :return: How many members were added and removed, and how many changes failed
+        """
+        if self.task is not None and not self.task.done():
+            logger.info("Restarting {} role sync with a new target".format(self.name))
+            self.task.cancel()
+        task = self.task = asyncio.get_running_loop().create_task(self.apply(role, set(target)))
+        while True:
+            try:
+                return await asyncio.shield(task)
+            except asyncio.CancelledError:
+                if not task.cancelled() or task is self.task:
+                    raise
+                # Replaced by a newer reconcile, which is the one that decides how the role ends up
+                task = self.task
+
+    async def apply(self, role: discord.Role, target: Set[int]) -> Dict[str, int]:
+        start = perf_counter()
+        current = {member.id for member in role.members}
+        to_add = target - current
+        to_remove = current - target
+        self.progress = {'total': len(to_add) + len(to_remove), 'added': 0, 'removed': 0, 'failed': 0}
+        logger.info("Syncing {} role: {} to add, {} to remove, {} unchanged".format(
+            self.name, len(to_add), len(to_remove), len(current & target)
+        ))
+        if not self.progress['total']:
+            return self.progress
+        semaphore = asyncio.Semaphore(RoleReconciler.CONCURRENCY)
+        self.next_report = RoleReconciler.PROGRESS_STEP
+        await asyncio.gather(
+            *(self.change(semaphore, role, user_id, True) for user_id in to_add),
+            *(self.change(semaphore, role, user_id, False) for user_id in to_remove)
+        )
+        logger.info("Synced {} role in {:.1f}s: {} added, {} removed, {} failed".format(
+            self.name, perf_counter() - start, self.progress['added'], self.progress['removed'], self.progress['failed']
+        ))
+        return self.progress
+
+    async def change(self, semaphore: asyncio.Semaphore, role: discord.Role, user_id: int, add: bool):
+        guild_id = role.guild.id
+        async with semaphore:
+            try:
+                if add:
+                    await self.client.http.add_role(guild_id, user_id, role.id, reason='Role sync')
+                    self.progress['added'] += 1
+                else:
+                    await self.client.http.remove_role(guild_id, user_id, role.id, reason='Role sync')
+                    self.progress['removed'] += 1
+            except discord.NotFound:
+                # Not a member anymore
+                self.progress['failed'] += 1
+            except discord.HTTPException as e:
+                logger.warning("Could not {} {} role for user {}: {}".format(
+                    'add' if add else 'remove', self.name, user_id, e
+                ))
+                self.progress['failed'] += 1
+        self.report()
+
+    def report(self):
+        progress = self.progress
+        done = progress['added'] + progress['removed'] + progress['failed']
+        if done < progress['total'] and done / progress['total'] >= self.next_report:
+            logger.info("{} role sync {:.0%} done ({} of {})".format(
+                self.name.capitalize(), done / progress['total'], done, progress['total']
+            ))
+            while self.next_report <= done / progress['total']:
+                self.next_report += RoleReconciler.PROGRESS_STEP
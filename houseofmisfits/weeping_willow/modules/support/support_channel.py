@@ -1,17 +1,22 @@
 import asyncio
 import os
+from datetime import datetime, timedelta
 
 import discord
 import asyncpg
 
+from houseofmisfits.weeping_willow.database import Statements
+
 import logging
 
-logging.basicConfig()
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 
 class SupportChannel:
+    # Closed channels are moved to the archive category after a while, by a scheduled job that survives restarts
+    ARCHIVE_JOB = 'archive_support_channel'
+    ARCHIVE_DELAY = timedelta(minutes=20)
+
     def __init__(self):
         self.client = None
         self.user = None
@@ -52,10 +57,7 @@ class SupportChannel:
     async def get_support_channel_id(self):
         async with self.client.acquire_data_connection() as conn:
             try:
-                result = await conn.fetchrow(
-                    "SELECT channel_id FROM support_session_channels WHERE member_id = $1",
-                    str(self.user.id)
-                )
+                result = await conn.fetchrow(Statements.SUPPORT_CHANNEL_FOR_MEMBER, str(self.user.id))
             except asyncpg.UndefinedTableError:
                 await SupportChannel.build_support_session_channels_table(conn)
                 return None
@@ -111,10 +113,7 @@ class SupportChannel:
     async def get_user_from_channel_id(self, channel_id):
         async with self.client.acquire_data_connection() as conn:
             try:
-                result = await conn.fetchrow(
-                    "SELECT member_id FROM support_session_channels WHERE channel_id = $1",
-                    str(channel_id)
-                )
+                result = await conn.fetchrow(Statements.SUPPORT_MEMBER_FOR_CHANNEL, str(channel_id))
             except asyncpg.UndefinedTableError:
                 await SupportChannel.build_support_session_channels_table(conn)
                 return None
@@ -127,12 +126,15 @@ class SupportChannel:
 
     async def archive(self):
         await self.channel.set_permissions(self.user, send_messages=False, read_messages=True)
-        loop = asyncio.get_running_loop()
-        loop.call_later(1200, self._schedule_archive_channel)
+        archive_at = datetime.utcnow() + SupportChannel.ARCHIVE_DELAY
+        await self.client.scheduler.once(SupportChannel.ARCHIVE_JOB, archive_at, {'channel_id': self.channel.id})
 
-    def _schedule_archive_channel(self):
-        loop = asyncio.get_running_loop()
-        loop.create_task(self._move_to_archives())
+    @classmethod
+    async def move_to_archives(cls, client, channel_id):
+        self = SupportChannel()
+        self.client = client
+        self.channel = await self._fetch_channel(channel_id)
+        await self._move_to_archives()
 
     async def _move_to_archives(self):
         category = await self.get_support_archive_category()
@@ -1,31 +1,38 @@
 import asyncio
 import logging
 
-from typing import AsyncIterable
+from typing import AsyncIterable, Set
 
 from houseofmisfits.weeping_willow.modules import Module
 from houseofmisfits.weeping_willow.modules.support.support_session import SupportSession
-from houseofmisfits.weeping_willow.triggers import Trigger, Command
+from houseofmisfits.weeping_willow.triggers import Trigger, Command, MessageContext
 
 from houseofmisfits.weeping_willow.modules.support import SupportChannel, SupportNotAllowedException
 
 import discord
 
-logging.basicConfig()
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 
 class SupportModule(Module):
 
     def __init__(self, client):
         self.client = client
+        self.confirm_tasks: Set[asyncio.Task] = set()
 
     async def get_triggers(self) -> AsyncIterable[Trigger]:
+        self.client.scheduler.handle(SupportChannel.ARCHIVE_JOB, self.archive_channel)
         yield Command(self.client, 'support', self.on_support).get_trigger()
         yield Command(self.client, 'close', self.on_close_request).get_trigger()
 
-    async def on_support(self, message: discord.Message):
+    async def close(self):
+        for task in list(self.confirm_tasks):
+            task.cancel()
+
+    async def archive_channel(self, payload):
+        await SupportChannel.move_to_archives(self.client, payload['channel_id'])
+
+    async def on_support(self, message: discord.Message, context: MessageContext):
         loop = asyncio.get_running_loop()
         loop.create_task(message.delete())
         loop.create_task(self.start_support_session(message))
@@ -49,25 +56,35 @@ class SupportModule(Module):
             # TODO: figure out what to do when someone can't initiate a support session
             pass
 
-    async def on_close_request(self, message):
+    async def on_close_request(self, message, context: MessageContext):
         try:
             channel = await SupportChannel.with_channel(message.channel, self.client)
             await message.delete()
-            if message.author.id == channel.user_id and await self.confirm_user_close(channel):
-                session = await SupportSession.in_channel(channel)
-                await session.close()
-                return True
-            elif await self.is_support(message.author):
-                session = await SupportSession.in_channel(channel)
-                await session.close()
-                return True
-            else:
-                logger.debug("Cancelling the closing of support session")
-                return True
-
         except ValueError:
             logger.debug(".close command issued in non-support channel, skipping")
             return False
+        if message.author.id == channel.user_id:
+            # Waiting for the user to confirm can take a while, so it runs as its own task
+            task = asyncio.get_running_loop().create_task(self.close_on_confirm(channel, context.author_roles))
+            self.confirm_tasks.add(task)
+            task.add_done_callback(self.confirm_tasks.discard)
+        elif await self.is_support(context.author_roles):
+            session = await SupportSession.in_channel(channel)
+            await session.close()
+        else:
+            logger.debug("Cancelling the closing of support session")
+        return True
+
+    async def close_on_confirm(self, channel, author_roles):
+        # noinspection PyBroadException
+        try:
+            if not await self.confirm_user_close(channel) and not await self.is_support(author_roles):
+                logger.debug("Cancelling the closing of support session")
+                return
+            session = await SupportSession.in_channel(channel)
+            await session.close()
+        except Exception:
+            logger.error("Could not close support session", exc_info=True)
 
     async def confirm_user_close(self, support_channel):
         msg = await support_channel.send("Are you sure you want to close the session?")
@@ -85,9 +102,6 @@ class SupportModule(Module):
         await msg.delete()
         return str(reaction.emoji) == '✅'
 
-    async def is_support(self, user):
+    async def is_support(self, role_ids):
         support_role = await self.client.get_config('support_role_id')
-        for role in user.roles:
-            if str(role.id) == support_role:
-                return True
-        return False
+        return support_role in role_ids
@@ -5,10 +5,9 @@ import asyncpg
 import logging
 
 from houseofmisfits.weeping_willow.modules.support import SupportChannel
+from houseofmisfits.weeping_willow.database import Statements
 
-logging.basicConfig()
 logger = logging.getLogger(__name__)
-logger.setLevel(logging.DEBUG)
 
 
 class SupportSession:
@@ -46,13 +45,7 @@ class SupportSession:
     async def _get_existing_session(self, user_id):
         async with self.client.acquire_data_connection() as conn:
             try:
-                return await conn.fetchrow(
-                    "SELECT * FROM support_session"
-                    "  WHERE member_id = $1 "
-                    "  AND session_status NOT IN ('Closed', 'Cancelled')"
-                    "  AND session_dt > CURRENT_DATE - 2",
-                    str(user_id)
-                )
+                return await conn.fetchrow(Statements.OPEN_SUPPORT_SESSION, str(user_id))
             except asyncpg.UndefinedTableError:
                 await self._build_support_session_table(conn)
                 return None
@@ -4,85 +4,83 @@ from datetime import datetime, timedelta
 
 import logging
 
-from asyncio import sleep
-
 from discord import TextChannel
 
 from houseofmisfits.weeping_willow.modules import Module
-from houseofmisfits.weeping_willow.triggers import ChannelTrigger
+from houseofmisfits.weeping_willow.modules.deletion_queue import DeletionQueue
+from houseofmisfits.weeping_willow.triggers import ChannelTrigger, MessageContext
 
 logger = logging.getLogger(__name__)
 
 
 class VentingModule(Module):
+    SCANNER = 'venting'
+    SCAN_SECONDS = 600
+    SCAN_JITTER_SECONDS = 30
+
     def __init__(self, client):
         from houseofmisfits.weeping_willow import WeepingWillowClient
         self.client: WeepingWillowClient = client
-        self.deletion_schedules = {}
-        self.messages = {}
-        self.is_open = True
-        self.scan_time = datetime.now()
-        self.client.loop.create_task(self.run_loop())
+        self.deletions = DeletionQueue(client)
         self.trigger = None
+        self.config_subscription = None
 
     async def get_triggers(self):
-        data_connection = self.client.data_connection
-        await data_connection.on_config_change('venting_channel', self.reset_module)
-        await data_connection.on_config_change('venting_deletion_seconds', self.reset_module)
+        if self.config_subscription is None:
+            # First time the module is registered, rather than a reload
+            self.config_subscription = await self.client.data_connection.on_config_change(
+                'venting_*', self.reset_module
+            )
+            self.client.loop.create_task(self.start_deletions())
 
-        venting_channel = await self.client.get_config('venting_channel')
+        venting_channel, _ = await self.client.get_configs(
+            ['venting_channel', 'venting_deletion_seconds'], {'venting_deletion_seconds': '300'}
+        )
         if venting_channel is None:
             logger.warning("Venting channel is not set, venting module will not work.")
-            self.is_open = False
+            self.trigger = None
         else:
             self.trigger = ChannelTrigger(venting_channel, self.process)
             yield self.trigger
 
     async def reset_module(self, key, value):
         if value is not None:
-            self.client.modules.remove(self)
-            self.client.triggers.remove(self.trigger)
-            self.is_open = False
-            await self.client.add_module(VentingModule(self.client))
+            await self.client.reload_module(self)
 
-    async def process(self, message: discord.Message):
-        deletion_seconds = int(await self.client.get_config('venting_deletion_seconds', '300'))
+    async def process(self, message: discord.Message, context: MessageContext = None):
+        deletion_seconds = await self.client.get_config('venting_deletion_seconds', '300')
         deletion_time = message.created_at + timedelta(seconds=deletion_seconds)
-        self.messages[message.id] = message
-        self.deletion_schedules[message.id] = deletion_time
-        logger.debug("Message will be deleted at {}".format(deletion_time.isoformat()))
+        await self.deletions.schedule(message, deletion_time)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Message will be deleted at {}".format(deletion_time.isoformat()))
         return False
 
-    async def run_loop(self):
-        while self.is_open:
-            await sleep(1)
-            await self.execute_scheduled_deletions()
-            if self.scan_time <= datetime.now():
-                await self.scan_messages()
-                self.scan_time = datetime.now() + timedelta(minutes=10)
-
-    async def execute_scheduled_deletions(self):
-        for message_id in self.deletion_schedules.copy():
-            if datetime.utcnow() >= self.deletion_schedules[message_id]:
-                message = self.messages[message_id]
-                logger.debug("Deleting message {}".format(message.id))
-                try:
-                    await message.delete()
-                except discord.errors.DiscordException as e:
-                    logger.debug("Unable to delete message {}. Got exception {}".format(message_id, str(e)))
-                finally:
-                    del self.deletion_schedules[message_id]
-                    del self.messages[message_id]
+    async def start_deletions(self):
+        """
+        Picks the saved deletions back up, then keeps looking for messages that were sent while the bot was offline or
+        disconnected, since those never made it into the deletion queue. Each scan only reads what came in since the
+        last one.
+        """
+        await self.deletions.start()
+        self.client.scheduler.every(
+            'venting: scan for missed messages', VentingModule.SCAN_SECONDS, self.scan_messages,
+            jitter=VentingModule.SCAN_JITTER_SECONDS, run_now=True
+        )
+
+    async def close(self):
+        self.deletions.stop()
 
     async def scan_messages(self):
         logger.debug("Scanning for missed messages")
         venting_channel = await self.client.get_config('venting_channel')
         if venting_channel is None:
             return
-        channel: TextChannel = await self.client.fetch_channel(int(venting_channel))
-        async for message in channel.history(limit=200):
-            if message.id not in self.deletion_schedules:
-                logger.debug("Found message {} not scheduled for deletion, adding to queue".format(
-                    message.id
-                ))
-                await self.process(message)
+        channel: TextChannel = await self.client.fetch_channel(venting_channel)
+        # Without a checkpoint, go back as far as messages can still be bulk deleted
+        oldest = discord.utils.time_snowflake(datetime.utcnow() - DeletionQueue.BULK_DELETE_MAX_AGE)
+        await self.client.history_scanner.scan(VentingModule.SCANNER, channel, self.process_missed, after=oldest)
+
+    async def process_missed(self, message: discord.Message):
+        if message.id not in self.deletions:
+            logger.debug("Found message {} not scheduled for deletion, adding to queue".format(message.id))
+            await self.process(message)
@@ -0,0 +1,297 @@
+import asyncio
+import heapq
+import json
+import random
+from datetime import datetime, time, timedelta, timezone, tzinfo
+from itertools import count
+from typing import Awaitable, Callable, Dict, List, Tuple, Union
+
+import asyncpg
+
+from houseofmisfits.weeping_willow.database import Statements
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+JobAction = Callable[[], Awaitable]
+JobHandler = Callable[[dict], Awaitable]
+
+
+class Every:
+    """
+    Runs a job every so many seconds
+    """
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    def next_after(self, after: datetime) -> datetime:
+        return after + timedelta(seconds=self.seconds)
+
+    def __str__(self):
+        return 'every {}'.format(timedelta(seconds=self.seconds))
+
+
+class DailyAt:
+    """
+    Runs a job once a day at a wall clock time. Without a timezone, the time is in the server's local time.
+    """
+    def __init__(self, at: time, tz: Union[tzinfo, None] = None):
+        self.at = at
+        self.tz = tz
+
+    def next_after(self, after: datetime) -> datetime:
+        local_after = after.replace(tzinfo=timezone.utc).astimezone(self.tz)
+        day = local_after.date()
+        while True:
+            wall_clock = datetime.combine(day, self.at)
+            # Every day is localized on its own, since the UTC offset changes with daylight saving time
+            if self.tz is None:
+                local = wall_clock.astimezone()
+            elif hasattr(self.tz, 'localize'):
+                local = self.tz.localize(wall_clock)
+            else:
+                local = wall_clock.replace(tzinfo=self.tz)
+            if local > local_after:
+                return local.astimezone(timezone.utc).replace(tzinfo=None)
+            day += timedelta(days=1)
+
+    def __str__(self):
+        return 'daily at {}{}'.format(self.at.strftime('%H:%M'), ' {}'.format(self.tz) if self.tz else '')
+
+
+class Job:
+    """
+    Something the scheduler runs. A recurring job has a schedule and an action, and only lives in memory, since it is
+    registered again every time the bot starts. A one-off job has a kind and a payload, is stored in the
+    `scheduled_jobs` table until it has run, and is run by the handler registered for its kind.
+
+    Times are naive UTC datetimes.
+    """
+    def __init__(self, name: str, next_run: datetime, action: JobAction = None, schedule=None, jitter: float = 0,
+                 job_id: int = None, kind: str = None, payload: dict = None):
+        self.name = name
+        self.next_run = next_run
+        self.action = action
+        self.schedule = schedule
+        self.jitter = jitter
+        self.job_id = job_id
+        self.kind = kind
+        self.payload = payload
+        self.last_run: Union[datetime, None] = None
+        self.runs = 0
+        self.errors = 0
+        self.task: Union[asyncio.Task, None] = None
+        self.cancelled = False
+
+    @property
+    def is_durable(self):
+        return self.job_id is not None
+
+    @property
+    def is_running(self):
+        return self.task is not None and not self.task.done()
+
+    def describe_schedule(self) -> str:
+        return str(self.schedule) if self.schedule is not None else 'once'
+
+
+class JobScheduler:
+    """
+    Runs jobs when they are due. Jobs wait in a heap ordered by their next run, and the scheduler sleeps until exactly
+    the first one is due, so it doesn't wake up at all while nothing is due.
+
+    Recurring jobs can be given some jitter, a random number of seconds up to which every run is pushed back, so jobs
+    that share a schedule don't all hit Discord or the database at once. A recurring job that is still running when
+    it comes due again skips that run.
+
+    A one-off job whose handler fails stays in the table and is tried again, waiting twice as long every time, until
+    it has failed `MAX_ATTEMPTS` times.
+    """
+    RETRY_SECONDS = 60
+    MAX_ATTEMPTS = 5
+
+    def __init__(self, client):
+        from houseofmisfits.weeping_willow import WeepingWillowClient
+        self.client: WeepingWillowClient = client
+        self.heap: List[Tuple[datetime, int, Job]] = []
+        self.sequence = count()
+        self.jobs: Dict[str, Job] = {}
+        self.handlers: Dict[str, JobHandler] = {}
+        # One-off jobs that came due before a handler for their kind was registered
+        self.parked: List[Job] = []
+        self.changed = asyncio.Event()
+        self.task: Union[asyncio.Task, None] = None
+
+    async def start(self):
+        """
+        Loads the one-off jobs that haven't run yet and starts running jobs
+        """
+        if self.task is not None:
+            return
+        try:
+            async with self.client.acquire_data_connection() as conn:
+                rows = await conn.fetch(Statements.SCHEDULED_JOBS)
+        except asyncpg.PostgresError:
+            logger.error("Could not load scheduled jobs", exc_info=True)
+            rows = []
+        for row in rows:
+            job = Job('{}#{}'.format(row['kind'], row['job_id']), row['run_at'], job_id=row['job_id'],
+                      kind=row['kind'], payload=json.loads(row['payload']))
+            job.errors = row['attempts']
+            self.add(job)
+        logger.info("Loaded {} scheduled jobs".format(len(rows)))
+        self.task = self.client.loop.create_task(self.run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def every(self, name: str, seconds: float, action: JobAction, jitter: float = 0, run_now=False) -> Job:
+        """
+        Runs a job every `seconds`, starting now if `run_now` is set. A job with the same name is replaced.
+        """
+        schedule = Every(seconds)
+        now = datetime.utcnow()
+        return self.add(Job(name, now if run_now else self.with_jitter(schedule.next_after(now), jitter), action,
+                            schedule, jitter))
+
+    def daily(self, name: str, at: time, action: JobAction, tz: Union[tzinfo, None] = None, jitter: float = 0) -> Job:
+        """
+        Runs a job every day at `at`. A job with the same name is replaced.
+        """
+        schedule = DailyAt(at, tz)
+        return self.add(Job(name, self.with_jitter(schedule.next_after(datetime.utcnow()), jitter), action, schedule,
+                            jitter))
+
+    async def once(self, kind: str, run_at: datetime, payload: dict) -> Job:
+        """
+        Runs the handler for `kind` with `payload` at `run_at`. The job is saved first, so it still runs if the bot
+        restarts in the meantime.
+        """
+        async with self.client.acquire_data_connection() as conn:
+            job_id = await conn.fetchval(Statements.ADD_SCHEDULED_JOB, kind, run_at, json.dumps(payload))
+        return self.add(Job('{}#{}'.format(kind, job_id), run_at, job_id=job_id, kind=kind, payload=payload))
+
+    def handle(self, kind: str, handler: JobHandler):
+        """
+        Sets the coroutine that runs one-off jobs of a kind. It is called with the job's payload.
+        """
+        self.handlers[kind] = handler
+        # Jobs of this kind that came due before there was anything to run them can run now
+        self.changed.set()
+
+    def cancel(self, name: str):
+        job = self.jobs.pop(name, None)
+        if job is not None:
+            job.cancelled = True
+
+    def add(self, job: Job) -> Job:
+        self.cancel(job.name)
+        self.jobs[job.name] = job
+        self.push(job)
+        return job
+
+    def push(self, job: Job):
+        heapq.heappush(self.heap, (job.next_run, next(self.sequence), job))
+        if self.heap[0][2] is job:
+            # The next job moved up, so the scheduler needs to wake up sooner
+            self.changed.set()
+
+    @staticmethod
+    def with_jitter(when: datetime, jitter: float) -> datetime:
+        return when + timedelta(seconds=random.uniform(0, jitter)) if jitter else when
+
+    def due_jobs(self) -> List[Job]:
+        now = datetime.utcnow()
+        due = []
+        while self.heap and self.heap[0][0] <= now:
+            next_run, _, job = heapq.heappop(self.heap)
+            if job.cancelled or job.next_run != next_run:
+                continue
+            if job.is_durable and job.kind not in self.handlers:
+                # Nothing can run it yet. It is looked at again when a handler is registered.
+                self.parked.append(job)
+            else:
+                due.append(job)
+        return due
+
+    async def run(self):
+        while True:
+            if self.parked:
+                runnable = [job for job in self.parked if job.kind in self.handlers and not job.cancelled]
+                self.parked = [job for job in self.parked if job.kind not in self.handlers and not job.cancelled]
+                for job in runnable:
+                    self.start_job(job)
+            if not self.heap:
+                await self.changed.wait()
+                self.changed.clear()
+                continue
+            delay = (self.heap[0][0] - datetime.utcnow()).total_seconds()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.changed.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                self.changed.clear()
+                continue
+            for job in self.due_jobs():
+                self.start_job(job)
+
+    def start_job(self, job: Job):
+        if job.is_running:
+            logger.warning("Job {} is still running from last time, skipping this run".format(job.name))
+        else:
+            job.task = self.client.loop.create_task(self.run_job(job))
+        if job.schedule is not None:
+            job.next_run = self.with_jitter(job.schedule.next_after(datetime.utcnow()), job.jitter)
+            self.push(job)
+
+    async def run_job(self, job: Job):
+        job.last_run = datetime.utcnow()
+        job.runs += 1
+        failed = False
+        try:
+            if job.is_durable:
+                await self.handlers[job.kind](job.payload)
+            else:
+                await job.action()
+        except Exception:
+            failed = True
+            job.errors += 1
+            logger.error("Job {} failed".format(job.name), exc_info=True)
+        if not job.is_durable:
+            return
+        if failed and job.errors < JobScheduler.MAX_ATTEMPTS:
+            await self.retry(job)
+            return
+        if failed:
+            logger.error("Job {} failed {} times, giving up on it".format(job.name, job.errors))
+        self.jobs.pop(job.name, None)
+        try:
+            async with self.client.acquire_data_connection() as conn:
+                await conn.execute(Statements.REMOVE_SCHEDULED_JOB, job.job_id)
+        except asyncpg.PostgresError:
+            logger.error("Could not remove job {} from the table, it will run again after a restart".format(
+                job.name
+            ), exc_info=True)
+
+    async def retry(self, job: Job):
+        """
+        Runs a failed one-off job again later. The new time is saved, so the retry survives a restart too.
+        """
+        job.next_run = datetime.utcnow() + timedelta(seconds=JobScheduler.RETRY_SECONDS * 2 ** (job.errors - 1))
+        logger.warning("Job {} will be tried again at {}".format(job.name, job.next_run.isoformat()))
+        self.push(job)
+        try:
+            async with self.client.acquire_data_connection() as conn:
+                await conn.execute(Statements.RETRY_SCHEDULED_JOB, job.job_id, job.next_run, job.errors)
+        except asyncpg.PostgresError:
+            logger.error("Could not save the retry of job {}".format(job.name), exc_info=True)
+
+    def list_jobs(self) -> List[Job]:
+        """
+        Gets every job that is waiting to run, soonest first
+        """
+        return sorted(self.jobs.values(), key=lambda job: job.next_run)
@@ -0,0 +1,145 @@
+from bisect import bisect_left
+from typing import Dict, Callable
+
+
+class LatencyHistogram:
+    """
+    Counts durations into a fixed set of buckets, so memory use stays the same no matter how many durations are
+    recorded. Percentiles are reported as the upper bound of the bucket they fall into.
+    """
+    # Upper bounds in seconds, doubling from 50µs up to about 26 seconds. Anything slower goes in the last bucket.
+    BOUNDS = tuple(0.00005 * 2 ** i for i in range(20))
+
+    __slots__ = ('counts', 'count', 'errors', 'total', 'max')
+
+    def __init__(self):
+        self.counts = [0] * (len(LatencyHistogram.BOUNDS) + 1)
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float, error=False):
+        self.counts[bisect_left(LatencyHistogram.BOUNDS, seconds)] += 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+        if error:
+            self.errors += 1
+
+    def percentile(self, percent: float) -> float:
+        """
+        Gets the duration, in seconds, that the given percentage of recorded durations were at or under
+        """
+        if self.count == 0:
+            return 0.0
+        target = self.count * percent / 100
+        seen = 0
+        for i, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= target:
+                return min(LatencyHistogram.BOUNDS[i], self.max) if i < len(LatencyHistogram.BOUNDS) else self.max
+        return self.max
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            'count': self.count,
+            'errors': self.errors,
+            'mean': self.total / self.count if self.count else 0.0,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+            'max': self.max
+        }
+
+
+class DispatchStats:
+    """
+    Keeps a latency histogram for every trigger evaluation and every handler that dispatch runs. Triggers are labelled
+    by trigger type and the action they run, and handlers by the module and qualified name of the function.
+    """
+    def __init__(self):
+        self.triggers: Dict[str, LatencyHistogram] = {}
+        self.handlers: Dict[str, LatencyHistogram] = {}
+        self.messages = LatencyHistogram()
+        self.labels: Dict[object, str] = {}
+
+    def record_message(self, seconds: float, error=False):
+        self.messages.record(seconds, error)
+
+    def record_trigger(self, trigger, seconds: float, error=False):
+        label = self.trigger_label(trigger)
+        histogram = self.triggers.get(label)
+        if histogram is None:
+            histogram = self.triggers[label] = LatencyHistogram()
+        histogram.record(seconds, error)
+
+    def record_handler(self, handler: Callable, seconds: float, error=False):
+        label = self.handler_label(handler)
+        histogram = self.handlers.get(label)
+        if histogram is None:
+            histogram = self.handlers[label] = LatencyHistogram()
+        histogram.record(seconds, error)
+
+    def trigger_label(self, trigger) -> str:
+        key = (type(trigger), getattr(trigger.action, '__func__', trigger.action))
+        label = self.labels.get(key)
+        if label is None:
+            label = self.labels[key] = '{} {}'.format(type(trigger).__name__, self.handler_label(trigger.action))
+        return label
+
+    def handler_label(self, handler: Callable) -> str:
+        # Bound methods are new objects every time they are looked up, but the function underneath them isn't
+        key = getattr(handler, '__func__', handler)
+        label = self.labels.get(key)
+        if label is None:
+            label = self.labels[key] = '{}.{}'.format(
+                getattr(handler, '__module__', '?'), getattr(handler, '__qualname__', repr(handler))
+            )
+        return label
+
+    def snapshot(self) -> Dict[str, Dict]:
+        """
+        Gets a copy of all of the stats collected so far. Durations are in seconds.
+        """
+        return {
+            'messages': self.messages.snapshot(),
+            'triggers': {label: histogram.snapshot() for label, histogram in self.triggers.items()},
+            'handlers': {label: histogram.snapshot() for label, histogram in self.handlers.items()}
+        }
+
+    def reset(self):
+        self.triggers = {}
+        self.handlers = {}
+        self.messages = LatencyHistogram()
+
+
+class DatabaseStats:
+    """
+    Keeps a latency histogram for how long callers waited for a pooled connection, and one for every statement run.
+    A slow `acquire` means the pool is too small for the load. Slow statements with a quick `acquire` mean the queries
+    themselves are the problem.
+    """
+    def __init__(self):
+        self.acquire = LatencyHistogram()
+        self.statements: Dict[str, LatencyHistogram] = {}
+
+    def record_acquire(self, seconds: float, error=False):
+        self.acquire.record(seconds, error)
+
+    def record_query(self, label: str, seconds: float, error=False):
+        histogram = self.statements.get(label)
+        if histogram is None:
+            histogram = self.statements[label] = LatencyHistogram()
+        histogram.record(seconds, error)
+
+    def snapshot(self) -> Dict[str, Dict]:
+        return {
+            'acquire': self.acquire.snapshot(),
+            'statements': {label: histogram.snapshot() for label, histogram in self.statements.items()}
+        }
+
+    def reset(self):
+        self.acquire = LatencyHistogram()
+        self.statements = {}
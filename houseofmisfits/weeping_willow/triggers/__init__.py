@@ -1,7 +1,12 @@
-__all__ = ['Trigger', 'ChannelTrigger', 'DMTrigger', 'Command']
+__all__ = ['Trigger', 'ChannelTrigger', 'DMTrigger', 'Command', 'TriggerIndex', 'TriggerRegistry', 'MessageContext',
+           'CommandPrefix']
 
+from .message_context import MessageContext
 from .trigger import Trigger
 from .channel_trigger import ChannelTrigger
 from .dm_trigger import DMTrigger
 from .command import Command
 from .command import CommandTrigger
+from .command_prefix import CommandPrefix
+from .trigger_index import TriggerIndex
+from .trigger_registry import TriggerRegistry
@@ -1,9 +1,13 @@
 import discord
 
-from houseofmisfits.weeping_willow.triggers import Trigger
+from houseofmisfits.weeping_willow.triggers import Trigger, MessageContext
 
 
 class ChannelTrigger(Trigger):
-    async def evaluate(self, message: discord.Message):
-        if message.channel.id == int(self.trigger_value):
+    def __init__(self, trigger_value, action):
+        super(ChannelTrigger, self).__init__(trigger_value, action)
+        self.channel_id = int(trigger_value)
+
+    async def evaluate(self, message: discord.Message, context: MessageContext):
+        if message.channel.id == self.channel_id:
             return self.action
@@ -0,0 +1,37 @@
+from typing import Union
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class CommandPrefix:
+    """
+    Holds the command prefix for the whole bot. It is read from the config table once and then kept up to date
+    whenever `command_prefix` is set, so commands never have to look it up themselves.
+    """
+    CONFIG_KEY = 'command_prefix'
+    DEFAULT = '.'
+
+    def __init__(self, client):
+        self.client = client
+        self.value: Union[str, None] = None
+        self.subscription = None
+
+    async def load(self):
+        """
+        Reads the prefix from the config table and starts watching it for changes
+        """
+        if self.subscription is None:
+            self.subscription = await self.client.data_connection.on_config_change(
+                CommandPrefix.CONFIG_KEY, self.on_change
+            )
+        self.value = await self.client.get_config(CommandPrefix.CONFIG_KEY, CommandPrefix.DEFAULT)
+        logger.debug("Command prefix is '{}'".format(self.value))
+
+    async def on_change(self, key, value):
+        self.value = value if value else CommandPrefix.DEFAULT
+        logger.info("Command prefix changed to '{}'".format(self.value))
+
+    def __str__(self):
+        return str(self.value)
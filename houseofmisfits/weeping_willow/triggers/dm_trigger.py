@@ -1,16 +1,17 @@
-from typing import Callable, Union, Awaitable
+from typing import Union
 
 import discord
 
-from houseofmisfits.weeping_willow.triggers import Trigger
+from houseofmisfits.weeping_willow.triggers import Trigger, MessageContext
+from houseofmisfits.weeping_willow.triggers.trigger import Action
 
 
 class DMTrigger(Trigger):
-    def __init__(self, action: Callable[[discord.Message], Awaitable[bool]]):
+    def __init__(self, action: Action):
         # Respond to all DMs
         super(DMTrigger, self).__init__(None, action)
 
-    async def evaluate(self, message: discord.Message) -> Union[Callable[[discord.Message], bool], None]:
+    async def evaluate(self, message: discord.Message, context: MessageContext) -> Union[Action, None]:
         if isinstance(message.channel, discord.DMChannel) and not message.author.bot:
             return self.action
         return None
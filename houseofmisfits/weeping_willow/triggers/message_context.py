@@ -0,0 +1,45 @@
+from functools import cached_property
+from typing import List, FrozenSet, Union
+
+import discord
+
+
+class MessageContext:
+    """
+    Holds what the triggers and modules need to know about an incoming message. Everything is worked out the first
+    time it is asked for and then reused, so a message is only split and inspected once no matter how many triggers
+    and handlers look at it.
+    """
+    def __init__(self, message: discord.Message, prefix: Union[str, None]):
+        self.message = message
+        self.prefix = prefix
+
+    @cached_property
+    def is_command(self) -> bool:
+        """
+        Whether the message starts with the command prefix
+        """
+        return bool(self.prefix) and self.message.content.startswith(self.prefix)
+
+    @cached_property
+    def command_name(self) -> Union[str, None]:
+        """
+        The command the message invokes, without the prefix, or None if the message is not a command
+        """
+        if not self.is_command:
+            return None
+        return self.message.content.split(' ', 1)[0][len(self.prefix):]
+
+    @cached_property
+    def args(self) -> List[str]:
+        """
+        The words of the message, with the command itself as the first one
+        """
+        return [arg for arg in self.message.content.split(' ') if arg]
+
+    @cached_property
+    def author_roles(self) -> FrozenSet[int]:
+        """
+        The IDs of the roles the author has. Empty if the message did not come from a guild member.
+        """
+        return frozenset(role.id for role in getattr(self.message.author, 'roles', ()))
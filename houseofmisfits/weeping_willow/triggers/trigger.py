@@ -2,15 +2,19 @@ from typing import Callable, Union, Awaitable
 
 import discord
 
+from houseofmisfits.weeping_willow.triggers.message_context import MessageContext
+
+Action = Callable[[discord.Message, MessageContext], Awaitable[bool]]
+
 
 class Trigger:
     TRIGGER_DESCRIPTION = 'On'
 
-    def __init__(self, trigger_value, action: Callable[[discord.Message], Awaitable[bool]]):
+    def __init__(self, trigger_value, action: Action):
         self.trigger_value = trigger_value
         self.action = action
 
-    async def evaluate(self, message: discord.Message) -> Union[Callable[[discord.Message], Awaitable[bool]], None]:
+    async def evaluate(self, message: discord.Message, context: MessageContext) -> Union[Action, None]:
         raise NotImplementedError()
 
     def __str__(self):
@@ -0,0 +1,77 @@
+from typing import Dict, List, Tuple, Iterable
+from heapq import merge
+
+import discord
+
+from houseofmisfits.weeping_willow.triggers import Trigger, MessageContext
+from houseofmisfits.weeping_willow.triggers.channel_trigger import ChannelTrigger
+from houseofmisfits.weeping_willow.triggers.command import CommandTrigger
+from houseofmisfits.weeping_willow.triggers.dm_trigger import DMTrigger
+
+
+class TriggerIndex:
+    """
+    Buckets triggers by the part of a message they react to, so a message only has to be evaluated against the
+    triggers that could possibly match it. Candidates are always handed back in the order the triggers were given to
+    the index, so the first trigger registered still takes precedence.
+
+    An index is never changed once it has been built. To change the triggers, build a new index and swap it in.
+    """
+    def __init__(self, triggers: Iterable[Trigger] = ()):
+        channel_triggers: Dict[int, List[Tuple[int, Trigger]]] = {}
+        command_triggers: Dict[str, List[Tuple[int, Trigger]]] = {}
+        dm_triggers: List[Tuple[int, Trigger]] = []
+        other_triggers: List[Tuple[int, Trigger]] = []
+        ordered: List[Trigger] = []
+        seen = set()
+        for trigger in triggers:
+            if trigger is None or trigger in seen:
+                continue
+            seen.add(trigger)
+            entry = (len(ordered), trigger)
+            ordered.append(trigger)
+            if isinstance(trigger, ChannelTrigger):
+                channel_triggers.setdefault(trigger.channel_id, []).append(entry)
+            elif isinstance(trigger, CommandTrigger):
+                for command_name in trigger.trigger_value.command:
+                    command_triggers.setdefault(command_name, []).append(entry)
+            elif isinstance(trigger, DMTrigger):
+                dm_triggers.append(entry)
+            else:
+                other_triggers.append(entry)
+
+        self.triggers: Tuple[Trigger, ...] = tuple(ordered)
+        self.channel_triggers = {key: tuple(bucket) for key, bucket in channel_triggers.items()}
+        self.command_triggers = {key: tuple(bucket) for key, bucket in command_triggers.items()}
+        self.dm_triggers = tuple(dm_triggers)
+        self.other_triggers = tuple(other_triggers)
+
+    def candidates(self, context: MessageContext) -> Iterable[Trigger]:
+        """
+        Gets the triggers that could match the message, in the order they were added
+        """
+        message = context.message
+        buckets = []
+        channel_bucket = self.channel_triggers.get(message.channel.id)
+        if channel_bucket:
+            buckets.append(channel_bucket)
+        if context.is_command:
+            command_bucket = self.command_triggers.get(context.command_name)
+            if command_bucket:
+                buckets.append(command_bucket)
+        if self.dm_triggers and isinstance(message.channel, discord.DMChannel):
+            buckets.append(self.dm_triggers)
+        if self.other_triggers:
+            buckets.append(self.other_triggers)
+
+        if not buckets:
+            return ()
+        if len(buckets) == 1:
+            return [trigger for _, trigger in buckets[0]]
+        return [trigger for _, trigger in merge(*buckets)]
+
+    def __iter__(self):
+        return iter(self.triggers)
+
+    def __len__(self):
+        return len(self.triggers)
@@ -0,0 +1,141 @@
+import asyncio
+from time import perf_counter
+from typing import Dict, List, Tuple, Sequence
+
+from houseofmisfits.weeping_willow.triggers import Trigger
+from houseofmisfits.weeping_willow.triggers.trigger_index import TriggerIndex
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class TriggerRegistry:
+    """
+    Keeps track of the triggers each module has registered. Whenever a module is added or reloaded, a brand new
+    TriggerIndex is built and published as `snapshot`. Dispatch only ever reads `snapshot`, so it never sees a half
+    updated set of triggers and never has to wait on a lock.
+
+    Triggers are ordered by the order their modules were added in, then by the order each module yielded them in.
+    Reloading a module keeps its place in that order.
+    """
+    def __init__(self):
+        self.modules: Tuple = ()
+        self.module_triggers: Dict[object, Tuple[Trigger, ...]] = {}
+        self.snapshot = TriggerIndex()
+        self.lock = asyncio.Lock()
+
+    async def add_module(self, module):
+        """
+        Registers a module and all of the triggers it yields. Adding a module that is already registered reloads it.
+        """
+        if module in self.module_triggers:
+            await self.reload_module(module)
+            return
+        triggers = await self.collect_triggers(module)
+        async with self.lock:
+            self.modules = self.modules + (module,)
+            self.module_triggers = {**self.module_triggers, module: triggers}
+            self.publish()
+
+    async def add_modules(self, modules: Sequence) -> Dict[object, float]:
+        """
+        Registers several modules at once. Their triggers are collected concurrently, except that a module waits for
+        every module named in its `depends_on` to finish first. The modules are still added in the order given, and
+        all of their triggers are published together.
+
+        A module that fails to give its triggers is logged and left out, along with any module that depends on it.
+        :return: How long each module that was added took to give its triggers, in seconds
+        """
+        modules = [module for module in modules if module not in self.module_triggers]
+        order = self.dependency_order(modules)
+        timings: Dict[object, float] = {}
+        tasks: Dict[object, asyncio.Task] = {}
+
+        async def collect(module):
+            for dependency in self.dependencies(module, modules):
+                if dependency in tasks:
+                    await asyncio.shield(tasks[dependency])
+            start = perf_counter()
+            triggers = await self.collect_triggers(module)
+            timings[module] = perf_counter() - start
+            return triggers
+
+        loop = asyncio.get_event_loop()
+        for module in order:
+            tasks[module] = loop.create_task(collect(module))
+        results = await asyncio.gather(*(tasks[module] for module in modules), return_exceptions=True)
+
+        collected = {}
+        for module, result in zip(modules, results):
+            if isinstance(result, BaseException):
+                logger.error("Could not start {}".format(type(module).__name__), exc_info=result)
+            else:
+                collected[module] = result
+        async with self.lock:
+            self.modules = self.modules + tuple(collected)
+            self.module_triggers = {**self.module_triggers, **collected}
+            self.publish()
+        return timings
+
+    @staticmethod
+    def dependencies(module, modules: Sequence) -> List:
+        """
+        Gets the modules, out of `modules`, that a module depends on
+        """
+        names = getattr(module, 'depends_on', ())
+        return [other for other in modules if type(other).__name__ in names]
+
+    @staticmethod
+    def dependency_order(modules: Sequence) -> List:
+        """
+        Orders modules so that every module comes after the modules it depends on
+        :raises ValueError: If the dependencies go around in a circle
+        """
+        order = []
+        visiting = set()
+
+        def visit(module):
+            if module in order:
+                return
+            if module in visiting:
+                raise ValueError("{} depends on itself".format(type(module).__name__))
+            visiting.add(module)
+            for dependency in TriggerRegistry.dependencies(module, modules):
+                visit(dependency)
+            visiting.discard(module)
+            order.append(module)
+
+        for module in modules:
+            visit(module)
+        return order
+
+    async def reload_module(self, module):
+        """
+        Asks a registered module for its triggers again and swaps them in for the ones it had before
+        """
+        if module not in self.module_triggers:
+            raise ValueError("{} is not registered".format(type(module).__name__))
+        triggers = await self.collect_triggers(module)
+        async with self.lock:
+            self.module_triggers = {**self.module_triggers, module: triggers}
+            self.publish()
+        logger.debug("Reloaded {} with {} triggers".format(type(module).__name__, len(triggers)))
+
+    @staticmethod
+    async def collect_triggers(module) -> Tuple[Trigger, ...]:
+        triggers: List[Trigger] = []
+        async for trigger in module.get_triggers():
+            if trigger is not None:
+                logger.debug("Adding trigger {}".format(str(trigger)))
+                triggers.append(trigger)
+        return tuple(triggers)
+
+    def publish(self):
+        self.snapshot = TriggerIndex(
+            trigger for module in self.modules for trigger in self.module_triggers[module]
+        )
+
+    @property
+    def triggers(self) -> Tuple[Trigger, ...]:
+        return self.snapshot.triggers
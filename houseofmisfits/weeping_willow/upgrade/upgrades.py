@@ -16,25 +16,28 @@ def upgrade_database(client):
 async def upgrade_database_async(client):
     logger.debug("Checking for database updates")
     current_version = await _get_current_version(client)
+    upgraded = False
     for from_version, to_version, func in version_functions:
         if current_version == from_version:
             logger.info("Upgrading from {} to {}".format(from_version, to_version))
             await func(client)
             await _set_version(client, to_version)
             current_version = to_version
+            upgraded = True
 
+    if upgraded:
+        # Statements prepared before the upgrade may not match the new schema
+        await client.data_connection.expire_connections()
     logger.debug("Database is up to date")
 
 
 async def _get_current_version(client):
-    conn = await client.data_connection.pool.acquire()
-    try:
-        result = await conn.fetchrow('SELECT version FROM _version')
-        return result['version']
-    except asyncpg.UndefinedTableError:
-        return '0.0.0'
-    finally:
-        await conn.close()
+    async with client.data_connection.pool.acquire() as conn:
+        try:
+            result = await conn.fetchrow('SELECT version FROM _version')
+            return result['version']
+        except asyncpg.UndefinedTableError:
+            return '0.0.0'
 
 
 async def _set_version(client, version):
@@ -109,3 +112,71 @@ async def make_module_commands(client):
                     CONSTRAINT event_participation_pkey PRIMARY KEY (participation_dt, member_id)
                 );
             """)
+
+
+@upgrade(from_version='0.0.2', to_version='0.0.3')
+async def notify_config_changes(client):
+    logger.info("Adding config change notifications")
+    async with client.data_connection.pool.acquire() as conn, conn.transaction():
+        await conn.execute("""
+            CREATE OR REPLACE FUNCTION notify_bot_config_change() RETURNS trigger AS $$
+            BEGIN
+                IF TG_OP = 'DELETE' THEN
+                    PERFORM pg_notify('bot_config_changed', OLD.config_key);
+                ELSE
+                    PERFORM pg_notify('bot_config_changed', NEW.config_key);
+                END IF;
+                RETURN NULL;
+            END;
+            $$ LANGUAGE plpgsql;
+        """)
+
+        await conn.execute("""
+            CREATE TRIGGER bot_config_changed
+            AFTER INSERT OR UPDATE OR DELETE ON bot_config
+            FOR EACH ROW EXECUTE PROCEDURE notify_bot_config_change();
+        """)
+
+
+@upgrade(from_version='0.0.3', to_version='0.0.4')
+async def create_scheduled_deletions(client):
+    logger.info("Creating scheduled_deletions table")
+    async with client.data_connection.pool.acquire() as conn, conn.transaction():
+        await conn.execute("""
+            CREATE TABLE scheduled_deletions (
+                message_id bigint PRIMARY KEY,
+                channel_id bigint NOT NULL,
+                delete_at TIMESTAMP NOT NULL
+            );
+        """)
+
+        await conn.execute("CREATE INDEX ix_scheduled_deletions_delete_at ON scheduled_deletions (delete_at)")
+
+
+@upgrade(from_version='0.0.4', to_version='0.0.5')
+async def create_history_checkpoints(client):
+    logger.info("Creating history_checkpoints table")
+    async with client.data_connection.pool.acquire() as conn, conn.transaction():
+        await conn.execute("""
+            CREATE TABLE history_checkpoints (
+                scanner VARCHAR(40) NOT NULL,
+                channel_id bigint NOT NULL,
+                message_id bigint NOT NULL,
+                CONSTRAINT history_checkpoints_pkey PRIMARY KEY (scanner, channel_id)
+            );
+        """)
+
+
+@upgrade(from_version='0.0.5', to_version='0.0.6')
+async def create_scheduled_jobs(client):
+    logger.info("Creating scheduled_jobs table")
+    async with client.data_connection.pool.acquire() as conn, conn.transaction():
+        await conn.execute("""
+            CREATE TABLE scheduled_jobs (
+                job_id SERIAL PRIMARY KEY,
+                kind VARCHAR(40) NOT NULL,
+                run_at TIMESTAMP NOT NULL,
+                payload TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0
+            );
+        """)